@@ -0,0 +1,93 @@
+"""Latency of the logistic player comparison, for the model alone and through the endpoint.
+
+    python chess-stats/backend/benchmarks/bench_compare_players.py path/to/games.pgn
+
+Times predictor.predict_pair on cached player stats, then POST /compare_players
+over random pairs of players, and prints p50/p99. The endpoint is timed twice:
+through the Flask test client, and as the WSGI app alone on requests built
+beforehand, which leaves out the test client's own request building.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import load_data
+
+
+def percentiles(seconds):
+    micros = np.array(seconds) * 1e6
+    return f"p50 {np.percentile(micros, 50):.0f}us  p99 {np.percentile(micros, 99):.0f}us"
+
+
+def compare_environ(player1, player2):
+    body = json.dumps({"player1": player1, "player2": player2})
+    return EnvironBuilder(path="/compare_players", method="POST", data=body,
+                          content_type="application/json").get_environ()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pgn")
+    parser.add_argument("--cache-dir", default=load_data.CACHE_DIR, help="dataset cache; models go in its models/")
+    parser.add_argument("--pairs", type=int, default=300)
+    parser.add_argument("--calls", type=int, default=20000, help="predict_pair calls")
+    parser.add_argument("--requests", type=int, default=3000, help="POST /compare_players requests per client")
+    args = parser.parse_args()
+
+    # The server's warm-up loads PGN_FILE with the default cache directory; loading it
+    # here first leaves warm-up the in-memory dataset, and MODEL_DIR follows CACHE_DIR.
+    load_data.load_dataset(args.pgn, header_only=True, cache_dir=args.cache_dir)
+    load_data.PGN_FILE = args.pgn
+    load_data.CACHE_DIR = args.cache_dir
+    import server
+    server.warmup.wait()
+    logging.disable(logging.CRITICAL)
+    if not server.warmup.ready():
+        sys.exit(f"Warm-up failed: {server.warmup.stages()}")
+
+    players = load_data.dataset.player_counts.index.tolist()
+    rng = np.random.default_rng(0)
+    pairs = [tuple(rng.choice(players, 2, replace=False)) for _ in range(args.pairs)]
+    stats = {player: server.player_stats(player)[0] for pair in pairs for player in pair}
+    predictor = server.logistic_model["predictor"]
+
+    timings = []
+    for i in range(args.calls):
+        p1, p2 = pairs[i % len(pairs)]
+        start = time.perf_counter()
+        predictor.predict_pair(p1, stats[p1], p2, stats[p2])
+        timings.append(time.perf_counter() - start)
+    print(f"predict_pair                       {percentiles(timings)}")
+
+    client = server.app.test_client()
+    timings = []
+    for i in range(args.requests):
+        p1, p2 = pairs[i % len(pairs)]
+        start = time.perf_counter()
+        response = client.post("/compare_players", json={"player1": p1, "player2": p2})
+        timings.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            sys.exit(f"POST /compare_players returned {response.status_code}: {response.get_data(as_text=True)}")
+    print(f"POST /compare_players, test client {percentiles(timings)}")
+
+    environs = [compare_environ(*pairs[i % len(pairs)]) for i in range(args.requests)]
+    timings = []
+    for environ in environs:
+        statuses = []
+        start = time.perf_counter()
+        b"".join(server.app.wsgi_app(environ, lambda status, headers: statuses.append(status)))
+        timings.append(time.perf_counter() - start)
+        if not statuses[0].startswith("200"):
+            sys.exit(f"POST /compare_players returned {statuses[0]}")
+    print(f"POST /compare_players, WSGI app    {percentiles(timings)}")
+
+
+if __name__ == "__main__":
+    main()
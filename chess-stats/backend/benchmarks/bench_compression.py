@@ -0,0 +1,78 @@
+"""Header-only load throughput of a PGN read plain and from .gz, .bz2, .xz and .zst archives.
+
+    python chess-stats/backend/benchmarks/bench_compression.py path/to/games.pgn
+
+The compressed copies are written to a temporary directory (.zst only when
+the zstandard package is installed). Every variant must load to the same
+df_games.
+"""
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pandas.testing as pdt
+from load_data import load_dataset
+
+COMPRESSORS = {
+    ".gz": lambda path: gzip.open(path, "wb"),
+    ".bz2": lambda path: bz2.open(path, "wb"),
+    ".xz": lambda path: lzma.open(path, "wb"),
+}
+
+
+def _zstd_writer(path):
+    import zstandard
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+
+
+def compressed_copies(pgn_path, out_dir):
+    compressors = dict(COMPRESSORS)
+    try:
+        import zstandard  # noqa: F401
+        compressors[".zst"] = _zstd_writer
+    except ImportError:
+        print("zstandard is not installed, skipping .zst")
+    copies = {"plain": pgn_path}
+    for ext, open_writer in compressors.items():
+        path = os.path.join(out_dir, os.path.basename(pgn_path) + ext)
+        with open(pgn_path, "rb") as src, open_writer(path) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        copies[ext[1:]] = path
+    return copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pgn")
+    parser.add_argument("--repeat", type=int, default=1, help="loads per variant; the best is reported")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    text_mb = os.path.getsize(args.pgn) / 1e6
+    with tempfile.TemporaryDirectory() as out_dir:
+        baseline = None
+        print(f"{'format':6} {'on disk':>10} {'load':>8} {'PGN text':>12}")
+        for name, path in compressed_copies(args.pgn, out_dir).items():
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                df = load_dataset(path, header_only=True, workers=1, cache_dir=None)
+                best = min(best, time.perf_counter() - start)
+            if baseline is None:
+                baseline = df
+            else:
+                pdt.assert_frame_equal(baseline, df)
+            print(f"{name:6} {os.path.getsize(path) / 1e6:7.1f} MB {best:7.2f}s {text_mb / best:7.1f} MB/s")
+        print(f"{len(baseline)} games, identical df_games for every format")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Time and peak memory of all-features k-means, sparse (KMeans and MiniBatch) against the dense pipeline.
+
+    python chess-stats/backend/benchmarks/bench_kmeans.py --players 10000 100000 1000000
+
+Players are synthetic: Elo and game counts at random, and a Zipf-distributed
+set of openings each. Every run is a separate process, so peak memory is per
+run. Sparse runs time perform_kmeans; the dense run is the pipeline it
+replaced, a centered StandardScaler, KMeans, PCA and the exact silhouette on
+the densified matrix, and is skipped when that matrix would not fit in --dense-max-gb.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kmeans_alg import SparseCounts, perform_kmeans, _feature_matrix
+
+NUM_VARIANTS = 20
+
+
+def synthetic_features(num_players, num_openings, openings_per_player, seed=0):
+    """Returns (df_features, opening_counts, variant_counts) shaped like aggregate_player_features output."""
+    rng = np.random.default_rng(seed)
+    games = rng.integers(1, 200, num_players)
+    df = pd.DataFrame({
+        "player": [f"p{i}" for i in range(num_players)],
+        "games": games,
+        "avg_elo": rng.normal(1500, 300, num_players),
+        "avg_opponent_elo": rng.normal(1500, 200, num_players),
+        "param1": np.zeros(num_players),
+        "param2": np.zeros(num_players),
+        "most_common_opening": "o0"
+    })
+    rows = np.repeat(np.arange(num_players), openings_per_player)
+    columns = rng.zipf(1.3, len(rows)) % num_openings
+    openings = sparse.csr_matrix((rng.integers(1, 10, len(rows)), (rows, columns)),
+                                 shape=(num_players, num_openings))
+    openings.sum_duplicates()
+    variants = sparse.csr_matrix((games, (np.arange(num_players), rng.integers(0, NUM_VARIANTS, num_players))),
+                                 shape=(num_players, NUM_VARIANTS))
+    return (df, SparseCounts(openings, [f"o{i}" for i in range(num_openings)]),
+            SparseCounts(variants, [f"v{i}" for i in range(NUM_VARIANTS)]))
+
+
+def dense_kmeans(df, num_clusters, opening_counts, variant_counts):
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+    from sklearn.metrics import silhouette_score
+    from sklearn.preprocessing import StandardScaler
+    X, _ = _feature_matrix(df, "avg_elo", "avg_opponent_elo", True, opening_counts, variant_counts)
+    X_scaled = StandardScaler().fit_transform(X.toarray())
+    labels = KMeans(n_clusters=num_clusters, random_state=42).fit_predict(X_scaled)
+    PCA(n_components=2, random_state=42).fit_transform(X_scaled)
+    return silhouette_score(X_scaled, labels)
+
+
+def run(pipeline, num_players, args):
+    logging.disable(logging.INFO)
+    df, opening_counts, variant_counts = synthetic_features(num_players, args.openings, args.per_player)
+    start = time.perf_counter()
+    if pipeline == "dense":
+        dense_kmeans(df, args.clusters, opening_counts, variant_counts)
+    else:
+        perform_kmeans(df, args.clusters, use_all_features=True, opening_counts=opening_counts,
+                       variant_counts=variant_counts, engine=pipeline)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux.
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6
+
+
+def _put(queue, func, args):
+    queue.put(func(*args))
+
+
+def in_process(func, *args):
+    """Runs func(*args) in a fresh process and returns its result."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # Not a pool: pool workers are daemons, which cannot start processes of their own.
+    process = context.Process(target=_put, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--openings", type=int, default=3000)
+    parser.add_argument("--per-player", type=int, default=15, help="distinct openings drawn per player")
+    parser.add_argument("--dense-max-gb", type=float, default=2.0)
+    args = parser.parse_args()
+
+    pipelines = ["dense", "kmeans", "minibatch"]
+    print(f"{'players':>9} " + " ".join(f"{name:>18}" for name in pipelines))
+    for num_players in args.players:
+        cells = []
+        for pipeline in pipelines:
+            dense_gb = num_players * (args.openings + NUM_VARIANTS + 3) * 8 / 1e9
+            if pipeline == "dense" and dense_gb > args.dense_max_gb:
+                cells.append(f"skipped ({dense_gb:.1f} GB)")
+                continue
+            seconds, peak_gb = in_process(run, pipeline, num_players, args)
+            cells.append(f"{seconds:7.1f}s {peak_gb:5.2f} GB")
+        print(f"{num_players:>9} " + " ".join(f"{cell:>18}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Training time and peak memory of train_logistic_model against the dense pipeline it replaced.
+
+    python chess-stats/backend/benchmarks/bench_logistic.py path/to/games.pgn --games 1000000
+
+The games are loaded header-only, then resampled with replacement to --games
+rows when given. The dense pipeline is the original one: an iterrows loop
+building the features, pd.get_dummies, a centered StandardScaler and lbfgs
+on the dense matrix, with 5-fold cross-validation on one core. Every run is
+a separate process, so peak memory is per run; "data" is the memory in use
+once df_games is loaded.
+"""
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from load_data import load_dataset
+import logistic_regression_alg
+
+
+def dense_train(df):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.model_selection import train_test_split, cross_val_score
+    valid_games = df[df["Result"].isin(["1-0", "0-1"])].copy()
+    features, labels = [], []
+    for _, row in valid_games.iterrows():
+        opening = re.split(r'[:#,]', str(row["Opening"]))[0].strip()
+        features.append({"difference": row["WhiteElo"] - row["BlackElo"], "opening": opening,
+                         "num_moves": row["Moves"]})
+        labels.append(1 if row["Result"] == "1-0" else 0)
+    df_encoded = pd.get_dummies(pd.DataFrame(features), columns=["opening"], drop_first=True)
+    X = StandardScaler().fit_transform(df_encoded)
+    X_train, X_test, y_train, y_test = train_test_split(X, labels, test_size=0.2, random_state=42)
+    model = LogisticRegression(max_iter=1000)
+    model.fit(X_train, y_train)
+    cross_val_score(model, X, labels, cv=5)
+    return model.score(X_test, y_test)
+
+
+def sparse_train(df):
+    _, _, _, metrics = logistic_regression_alg.train_logistic_model(df)
+    return metrics["test_accuracy"]
+
+
+def peak_mb():
+    # ru_maxrss is in kB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def run(pipeline, args):
+    logging.disable(logging.INFO)
+    df = load_dataset(args.pgn, header_only=True, cache_dir=None)
+    if args.games:
+        rows = np.random.default_rng(0).integers(0, len(df), args.games)
+        df = df.iloc[rows].reset_index(drop=True)
+    data_mb = peak_mb()
+    start = time.perf_counter()
+    accuracy = (dense_train if pipeline == "dense" else sparse_train)(df)
+    return len(df), time.perf_counter() - start, peak_mb(), data_mb, accuracy
+
+
+def _put(queue, func, args):
+    queue.put(func(*args))
+
+
+def in_process(func, *args):
+    """Runs func(*args) in a fresh process and returns its result."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # Not a pool: pool workers are daemons, which cannot start processes of their own.
+    process = context.Process(target=_put, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pgn")
+    parser.add_argument("--games", type=int, help="resample the games to this many rows")
+    parser.add_argument("--pipelines", nargs="+", choices=["dense", "sparse"], default=["dense", "sparse"])
+    args = parser.parse_args()
+
+    print(f"{'pipeline':8} {'games':>9} {'train':>8} {'peak MB':>8} {'data MB':>8} {'test acc':>9}")
+    for pipeline in args.pipelines:
+        games, seconds, peak, data, accuracy = in_process(run, pipeline, args)
+        print(f"{pipeline:8} {games:9} {seconds:7.1f}s {peak:8.0f} {data:8.0f} {accuracy:9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Memory of df_games in the compact layout against the plain object columns it replaced.
+
+    python chess-stats/backend/benchmarks/bench_memory.py path/to/games.pgn
+
+Sizes are DataFrame.memory_usage(deep=True), per column and in total.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from load_data import parse_pgn_file, compact_games
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pgn")
+    parser.add_argument("--full", action="store_true", help="parse with chess.pgn instead of header-only")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    raw = parse_pgn_file(args.pgn, header_only=not args.full)
+    raw.dropna(inplace=True)
+    # The layout filter_games produced before compact_games: one Python object per string cell.
+    plain = raw[(raw["WhiteElo"] != 0) & (raw["BlackElo"] != 0)]
+    start = time.perf_counter()
+    compact = compact_games(plain.copy())
+    seconds = time.perf_counter() - start
+
+    before, after = plain.memory_usage(deep=True), compact.memory_usage(deep=True)
+    print(f"{'column':16} {'plain MB':>9} {'compact MB':>11}  dtype")
+    for column in compact.columns:
+        plain_mb = before[column] / 1e6 if column in before else 0.0
+        print(f"{column:16} {plain_mb:9.2f} {after[column] / 1e6:11.2f}  {compact[column].dtype}")
+    print(f"{len(compact)} games: {before.sum() / 1e6:.1f} MB -> {after.sum() / 1e6:.1f} MB "
+          f"({before.sum() / after.sum():.1f}x), compacted in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
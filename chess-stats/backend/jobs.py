@@ -0,0 +1,102 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Runs expensive requests on background threads and tracks them by job ID.
+
+    Submitting a key that already has a queued or running job returns that
+    job's ID instead of starting the work again. Finished jobs are kept until
+    max_jobs newer ones push them out. With a store (a Flask cache shared by
+    several worker processes) job records are mirrored there, so any worker
+    can report on a job another one is running.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=256, store=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._max_jobs = max_jobs
+        self._store = store
+
+    def _new_job(self, status):
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "job_id": job_id,
+            "status": status,
+            "stage": None,
+            "submitted": time.time(),
+            "finished": None,
+            "result": None,
+            "error": None,
+        }
+        while len(self._jobs) > self._max_jobs:
+            oldest = next((j for j, job in self._jobs.items() if job["status"] in ("done", "failed")), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+        self._save(job_id)
+        return job_id
+
+    def _save(self, job_id):
+        if self._store is not None:
+            self._store.set(f"job_{job_id}", self._jobs[job_id], timeout=60*60*24)
+
+    def submit(self, key, func, *args, **kwargs):
+        """Queues func(*args, progress=callback, **kwargs) and returns its job ID.
+
+        The callback takes a stage name and is shown in the job status.
+        """
+        with self._lock:
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                return job_id
+            job_id = self._new_job("queued")
+            self._in_flight[key] = job_id
+        self._executor.submit(self._run, job_id, key, func, args, kwargs)
+        logger.info("Queued job %s for %s", job_id, key)
+        return job_id
+
+    def add_result(self, result):
+        """Records an already available result as a finished job and returns its ID."""
+        with self._lock:
+            job_id = self._new_job("done")
+            self._jobs[job_id].update(result=result, finished=time.time())
+            self._save(job_id)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                self._save(job_id)
+
+    def _run(self, job_id, key, func, args, kwargs):
+        self._update(job_id, status="running")
+        try:
+            result = func(*args, progress=lambda stage: self._update(job_id, stage=stage), **kwargs)
+            self._update(job_id, status="done", stage=None, result=result, finished=time.time())
+            logger.info("Job %s finished", job_id)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._update(job_id, status="failed", error=str(e), finished=time.time())
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get(self, job_id):
+        """Returns a copy of the job's status record, or None for an unknown ID."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        if self._store is not None:
+            return self._store.get(f"job_{job_id}")
+        return None
@@ -2,200 +2,541 @@ import matplotlib
 matplotlib.use("Agg")
 import pandas as pd
 import logging
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-from sklearn.metrics import silhouette_score
-import matplotlib.pyplot as plt
+from sklearn.metrics import silhouette_score, pairwise_distances_argmin
+from sklearn import config_context
+from matplotlib.figure import Figure
 import seaborn as sns
-import io, base64
-from collections import Counter
+import io
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
 
 logger = logging.getLogger(__name__)
 
+# Silhouette is quadratic in the number of players; larger fits score a random sample.
+SILHOUETTE_SAMPLE_SIZE = 10000
+
+# Working memory (MB) that sklearn's chunked distance computations may use during a k sweep.
+SWEEP_WORKING_MEMORY = 256
+
+KMEANS_ENGINES = {
+    "kmeans": lambda k, init="k-means++": KMeans(n_clusters=k, init=init, random_state=42),
+    "minibatch": lambda k, init="k-means++": MiniBatchKMeans(n_clusters=k, init=init, batch_size=4096,
+                                                             random_state=42),
+}
+
+# ClusterModel.update refits from scratch every REFIT_EVERY updates, and once more than
+# REFIT_DRIFT of the players have been re-assigned since the last fit, so that scaling,
+# projection and centroids fitted on older data cannot drift far from a fresh fit.
+REFIT_EVERY = 20
+REFIT_DRIFT = 0.2
+
+PLOT_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+# first_seen, kept for opening counts only, has the matrix's sparsity pattern and holds
+# 1 + the long row in which each (player, name) pair first appeared, so that
+# update_player_features can break most-common ties as a full aggregation would.
+SparseCounts = namedtuple("SparseCounts", ["matrix", "vocabulary", "first_seen"], defaults=(None,))
+
+def _sparse_counts(row, column, vocabulary, num_rows):
+    matrix = sparse.csr_matrix(
+        (np.ones(len(row), dtype=np.int64), (row, column)),
+        shape=(num_rows, len(vocabulary))
+    )
+    matrix.sum_duplicates()
+    return SparseCounts(matrix, vocabulary)
+
+def _vocabulary_columns(values, long_rows):
+    """Maps a categorical column onto the sorted vocabulary of the values it uses.
+
+    Returns (vocabulary, column of each long row).
+    """
+    values = values.astype("category")
+    codes = values.cat.codes.to_numpy()[long_rows]
+    used = np.unique(codes)
+    names = np.asarray(values.cat.categories[used], dtype=object)
+    order = np.argsort(names, kind="stable")
+    column_of_code = np.zeros(len(values.cat.categories), dtype=np.int64)
+    column_of_code[used[order]] = np.arange(len(used))
+    return names[order].tolist(), column_of_code[codes]
+
+def _most_common(counts, rows):
+    """Returns, for the given matrix rows, the column of the most common name; ties go to the one met first."""
+    matrix, first_seen = counts.matrix[rows], counts.first_seen[rows]
+    matrix.sort_indices()
+    first_seen.sort_indices()
+    entry_row = np.repeat(np.arange(len(rows)), np.diff(matrix.indptr))
+    best = np.lexsort((first_seen.data, -matrix.data, entry_row))
+    best = best[np.unique(entry_row[best], return_index=True)[1]]
+    return matrix.indices[best]
+
 def aggregate_player_features(df):
+    """Aggregates per-player clustering features from df_games in one vectorized pass.
+
+    Returns (df_features, opening_counts, variant_counts). df_features has one
+    row per player in order of first appearance; the counts are SparseCounts
+    whose matrix rows line up with df_features and whose columns follow the
+    sorted vocabulary of opening or variant names.
+    """
     logger.info("Aggregating player features for KMeans clustering...")
-    stats = {}
-    for idx, row in df.iterrows():
-        for side in ["White", "Black"]:
-            player = row[side]
-            opponent_elo = row["BlackElo"] if side == "White" else row["WhiteElo"]
-            player_elo = row["WhiteElo"] if side == "White" else row["BlackElo"]
-            if player not in stats:
-                stats[player] = {
-                    "games": 0,
-                    "total_elo": 0,
-                    "total_opp_elo": 0,
-                    "param1_values": [],
-                    "param2_values": [],
-                    "openings": [],
-                    "game_types": {},
-                    "opening_counts": {},  # NEW: store opening counts
-                    "variant_counts": {}   # NEW: store variant counts
-                }
-            stats[player]["games"] += 1
-            stats[player]["total_elo"] += player_elo
-            stats[player]["total_opp_elo"] += opponent_elo
-            stats[player]["param1_values"].append(row.get("Param1", 0))
-            stats[player]["param2_values"].append(row.get("Param2", 0))
-            if "Opening" in df.columns and pd.notnull(row["Opening"]):
-                opening = row["Opening"]
-                stats[player]["openings"].append(opening)
-                stats[player]["opening_counts"][opening] = stats[player]["opening_counts"].get(opening, 0) + 1
-            if "Variant" in df.columns and pd.notnull(row["Variant"]):
-                variant = row["Variant"]
-                stats[player]["game_types"][variant] = stats[player]["game_types"].get(variant, 0) + 1
-                stats[player]["variant_counts"][variant] = stats[player]["variant_counts"].get(variant, 0) + 1
-        if idx % 1000 == 0:
-            logger.debug(f"Aggregated features for {idx} games")
-    data = []
-    for player, s in stats.items():
-        most_common_opening = None
-        if s["openings"]:
-            counter = Counter(s["openings"])
-            most_common_opening, _ = counter.most_common(1)[0]
-        data.append({
-            "player": player,
-            "games": s["games"],
-            "avg_elo": s["total_elo"] / s["games"],
-            "avg_opponent_elo": s["total_opp_elo"] / s["games"],
-            "param1": sum(s["param1_values"]) / s["games"],
-            "param2": sum(s["param2_values"]) / s["games"],
-            "param1_values": s["param1_values"],
-            "param2_values": s["param2_values"],
-            "most_common_opening": most_common_opening,
-            "game_types": s["game_types"],
-            "opening_counts": s["opening_counts"],  
-            "variant_counts": s["variant_counts"]   
-        })
-    df_features = pd.DataFrame(data)
+    white = df["White"].astype("category")
+    black = df["Black"].astype("category")
+    players = white.cat.categories.union(black.cat.categories)
+    white_ids = players.get_indexer(white.cat.categories)[white.cat.codes.to_numpy()]
+    black_ids = players.get_indexer(black.cat.categories)[black.cat.codes.to_numpy()]
+    white_elo = df["WhiteElo"].to_numpy().astype(np.int64)
+    black_elo = df["BlackElo"].to_numpy().astype(np.int64)
+
+    # Long format, White then Black for each game: the order players are met in.
+    player = np.column_stack([white_ids, black_ids]).ravel()
+    player_elo = np.column_stack([white_elo, black_elo]).ravel()
+    opponent_elo = np.column_stack([black_elo, white_elo]).ravel()
+    long_rows = np.repeat(np.arange(len(df)), 2)
+
+    ids, first_seen, id_of_row = np.unique(player, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    row = rank[id_of_row.ravel()]
+    num_players = len(ids)
+
+    games = np.bincount(row, minlength=num_players)
+    opening_vocabulary, opening_column = _vocabulary_columns(df["Opening"], long_rows)
+    variant_vocabulary, variant_column = _vocabulary_columns(df["Variant"], long_rows)
+
+    width = max(len(opening_vocabulary), 1)
+    pairs, pair_first = np.unique(row.astype(np.int64) * width + opening_column, return_index=True)
+    pair_player, pair_opening = np.divmod(pairs, width)
+    opening_counts = _sparse_counts(row, opening_column, opening_vocabulary, num_players)._replace(
+        first_seen=sparse.csr_matrix((pair_first + 1, (pair_player, pair_opening)),
+                                     shape=(num_players, len(opening_vocabulary))))
+    # Most common opening; ties go to the one met first, as Counter.most_common does.
+    most_common_opening = np.asarray(opening_vocabulary, dtype=object)[_most_common(opening_counts,
+                                                                                      np.arange(num_players))]
+
+    df_features = pd.DataFrame({
+        "player": np.asarray(players[ids[order]], dtype=object),
+        "games": games,
+        "avg_elo": np.bincount(row, weights=player_elo, minlength=num_players) / games,
+        "avg_opponent_elo": np.bincount(row, weights=opponent_elo, minlength=num_players) / games,
+        # The baseline averaged Param1/Param2 columns that df_games never has, so these are always 0.
+        "param1": np.zeros(num_players),
+        "param2": np.zeros(num_players),
+        "most_common_opening": most_common_opening
+    })
+    variant_counts = _sparse_counts(row, variant_column, variant_vocabulary, num_players)
     logger.info("Aggregated player features shape: %s", df_features.shape)
-    return df_features
+    return df_features, opening_counts, variant_counts
 
-def perform_kmeans(df, num_clusters, x_axis="avg_elo", y_axis="avg_opponent_elo", use_all_features=False):
-    logger.info("Performing KMeans clustering with %d clusters", num_clusters)
+def _merge_counts(old, new, positions, num_players, long_rows):
+    """Adds new's rows to old's at the given row positions, on the union of both vocabularies.
+
+    long_rows is the number of long rows old was aggregated from.
+    """
+    vocabulary = np.union1d(np.asarray(old.vocabulary, dtype=object), np.asarray(new.vocabulary, dtype=object))
+    shape = (num_players, len(vocabulary))
+    # Both vocabularies are sorted, so remapping keeps each row's columns in order.
+    old_columns = np.searchsorted(vocabulary, np.asarray(old.vocabulary, dtype=object))
+    new_columns = np.searchsorted(vocabulary, np.asarray(new.vocabulary, dtype=object))
+    indptr = np.concatenate([old.matrix.indptr, np.full(num_players - old.matrix.shape[0], old.matrix.indptr[-1])])
+
+    def widen(matrix, offset=0):
+        # The old rows keep their place; rows past them are empty.
+        return sparse.csr_matrix((matrix.data + offset, old_columns[matrix.indices], indptr), shape=shape)
+
+    def place(matrix, offset=0):
+        coo = matrix.tocoo()
+        return sparse.csr_matrix((coo.data + offset, (positions[coo.row], new_columns[coo.col])), shape=shape)
+
+    merged = SparseCounts(widen(old.matrix) + place(new.matrix), vocabulary.tolist())
+    if old.first_seen is not None and new.first_seen is not None:
+        # New pairs come after every old long row; pairs already seen keep their old position.
+        old_first = widen(old.first_seen)
+        new_first = place(new.first_seen, long_rows)
+        first_seen = old_first + new_first - new_first.multiply(old_first.astype(bool))
+        first_seen.eliminate_zeros()
+        merged = merged._replace(first_seen=first_seen.tocsr())
+    return merged
+
+def update_player_features(df_features, opening_counts, variant_counts, games):
+    """Merges games appended to df_games into features aggregated before they were appended.
+
+    games holds only the appended rows. Returns what aggregate_player_features
+    returns for the old and new games together, at the cost of aggregating
+    the new games and adding them to the old counts: players keep their rows,
+    new players are added in order of first appearance, and the averages and
+    most common openings of the players in games are recomputed.
+    """
+    if games.empty:
+        return df_features, opening_counts, variant_counts
+    new_features, new_openings, new_variants = aggregate_player_features(games)
+    num_old = len(df_features)
+    positions = pd.Index(df_features["player"]).get_indexer(new_features["player"])
+    added = positions < 0
+    positions[added] = num_old + np.arange(added.sum())
+    num_players = num_old + int(added.sum())
+
+    def extended(column, fill):
+        return np.concatenate([df_features[column].to_numpy(), np.full(num_players - num_old, fill)])
+
+    old_games = extended("games", 0)
+    games_played = old_games.copy()
+    games_played[positions] += new_features["games"].to_numpy()
+    averages = {}
+    for column in ("avg_elo", "avg_opponent_elo"):
+        # Each average is an integer rating sum over games, which rint recovers exactly.
+        totals = np.rint(extended(column, 0.0) * old_games)
+        totals[positions] += np.rint(new_features[column].to_numpy() * new_features["games"].to_numpy())
+        averages[column] = totals / games_played
+
+    # Every game is two long rows, one per player, and games counts them.
+    long_rows = int(df_features["games"].sum())
+    opening_counts = _merge_counts(opening_counts, new_openings, positions, num_players, long_rows)
+    variant_counts = _merge_counts(variant_counts, new_variants, positions, num_players, long_rows)
+    most_common_opening = np.concatenate([df_features["most_common_opening"].to_numpy(dtype=object),
+                                          np.empty(num_players - num_old, dtype=object)])
+    most_common_opening[positions] = np.asarray(opening_counts.vocabulary, dtype=object)[
+        _most_common(opening_counts, positions)]
+    df_features = pd.DataFrame({
+        "player": np.concatenate([df_features["player"].to_numpy(dtype=object),
+                                  new_features["player"].to_numpy(dtype=object)[added]]),
+        "games": games_played,
+        **averages,
+        "param1": np.zeros(num_players),
+        "param2": np.zeros(num_players),
+        "most_common_opening": most_common_opening
+    })
+    logger.info("Merged %d new games into player features: %d players, %d new",
+                len(games), num_players, num_players - num_old)
+    return df_features, opening_counts, variant_counts
+
+def _average_counts(counts, members):
+    """Per-name average count over the given feature rows, for names that occur at all."""
+    if counts is None or not len(members):
+        return {}
+    totals = np.asarray(counts.matrix[members].sum(axis=0)).ravel()
+    return {counts.vocabulary[i]: float(totals[i]) / len(members) for i in totals.nonzero()[0]}
+
+def render_cluster_plot(dim1, dim2, clusters, fmt="png", width=800, height=600):
+    """Renders the 2D projection of a clustering result as PNG or SVG bytes, width x height pixels."""
+    dpi = 100
+    # A standalone Figure keeps no pyplot state, so concurrent renders are safe.
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    ax = fig.subplots()
+    data = pd.DataFrame({"dim1": dim1, "dim2": dim2, "cluster": clusters})
+    sns.scatterplot(x="dim1", y="dim2", hue="cluster", data=data, palette="viridis", ax=ax)
+    ax.set_title("KMeans Clustering")
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt)
+    return buf.getvalue()
+
+def _feature_matrix(df, x_axis, y_axis, use_all_features, opening_counts, variant_counts):
+    """Builds the design matrix for clustering; returns (X, an unfitted scaler suited to it)."""
     if use_all_features:
-        import numpy as np
         base_features = ["games", "avg_elo", "avg_opponent_elo"]
-        X_list = []
-        all_types = set()
-        all_openings = set()
-        for row in df["game_types"]:
-            if isinstance(row, dict):
-                all_types.update(row.keys())
-        for row in df["opening_counts"]:
-            if isinstance(row, dict):
-                all_openings.update(row.keys())
-        all_types = sorted(list(all_types))
-        all_openings = sorted(list(all_openings))
-        for idx, row in df.iterrows():
-            features = [row[feat] for feat in base_features]
-            if isinstance(row["game_types"], dict):
-                for gt in all_types:
-                    features.append(row["game_types"].get(gt, 0))
-            else:
-                features.extend([0]*len(all_types))
-            if isinstance(row["opening_counts"], dict):
-                for op in all_openings:
-                    features.append(row["opening_counts"].get(op, 0))
-            else:
-                features.extend([0]*len(all_openings))
-            X_list.append(features)
-        X = np.array(X_list)
+        blocks = [sparse.csr_matrix(df[base_features].to_numpy(dtype=float))]
+        blocks += [counts.matrix for counts in (variant_counts, opening_counts) if counts is not None]
+        X = sparse.hstack(blocks, format="csr")
+        # Centering would densify X; k-means, silhouette and PCA are shift invariant anyway.
+        scaler = StandardScaler(with_mean=False)
     else:
         x_col = x_axis.replace("_values", "") if x_axis.endswith("_values") else x_axis
         y_col = y_axis.replace("_values", "") if y_axis.endswith("_values") else y_axis
         if x_col not in df.columns or y_col not in df.columns:
             raise ValueError("Invalid x_axis or y_axis parameter.")
         X = df[[x_col, y_col]].values
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    kmeans = KMeans(n_clusters=num_clusters, init="k-means++", random_state=42)
-    labels = kmeans.fit_predict(X_scaled)
-    df["cluster"] = labels
-
-    cluster_colors = sns.color_palette("viridis", num_clusters).as_hex()
-
-    sil_score = silhouette_score(X_scaled, labels)
-    
-    logger.info("Using PCA for dimensionality reduction")
-    reducer = PCA(n_components=2, random_state=42)
-    X_reduced = reducer.fit_transform(X_scaled)
-    df["dim1"] = X_reduced[:, 0]
-    df["dim2"] = X_reduced[:, 1]
-
-    logger.info("Generating scatter plot")
-    plt.figure(figsize=(8, 6))
-    sns.scatterplot(x="dim1", y="dim2", hue="cluster", data=df, palette="viridis")
-    plt.title("KMeans Clustering")
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    plt.close()
-
-    cluster_summary = df.groupby("cluster").agg(
-        avg_elo=("avg_elo", "mean"),
-        avg_opponent_elo=("avg_opponent_elo", "mean"),
-        player_count=("player", "count")
-    ).reset_index().to_dict(orient="records")
-    for summary in cluster_summary:
-        summary["cluster_color"] = cluster_colors[int(summary["cluster"])]
-
-    numeric_cols = df.select_dtypes("number").columns
-    cluster_profiles = df.groupby("cluster")[numeric_cols].mean().to_dict(orient="index")
-    global_means = df[numeric_cols].mean()
-    cluster_key = {}
-    for cluster, profile in cluster_profiles.items():
-        key_info = {}
-        for col, val in profile.items():
-            key_info[col] = "High" if val > global_means[col] else "Low"
-        cluster_key[cluster] = key_info
-
-    detailed_cluster_stats = {}
-    for cluster in sorted(df["cluster"].unique()):
-        cluster_df = df[df["cluster"] == cluster]
-        avg_games = cluster_df["games"].mean()
-        avg_elo = cluster_df["avg_elo"].mean()
-        avg_opponent_elo = cluster_df["avg_opponent_elo"].mean()
-        game_types_sum = {}
-        opening_counts_sum = {}
-        for _, row in cluster_df.iterrows():
-            if isinstance(row.get("game_types"), dict):
-                for variant, cnt in row["game_types"].items():
-                    game_types_sum[variant] = game_types_sum.get(variant, 0) + cnt
-            if isinstance(row.get("opening_counts"), dict):
-                for opening, cnt in row["opening_counts"].items():
-                    opening_counts_sum[opening] = opening_counts_sum.get(opening, 0) + cnt
-        avg_game_types = {variant: total/len(cluster_df) for variant, total in game_types_sum.items()}
-        avg_opening_counts = {opening: total/len(cluster_df) for opening, total in opening_counts_sum.items()}
-        detailed_cluster_stats[cluster] = {
-            "avg_games": avg_games,
-            "avg_elo": avg_elo,
-            "avg_opponent_elo": avg_opponent_elo,
-            "avg_game_types": avg_game_types,
-            "avg_opening_counts": avg_opening_counts,
-            "cluster_color": cluster_colors[int(cluster)]
+        scaler = StandardScaler()
+    return X, scaler
+
+def _scaled_features(df, x_axis, y_axis, use_all_features, opening_counts, variant_counts):
+    """Builds the standardized design matrix for clustering; returns (X_scaled, fitted scaler)."""
+    X, scaler = _feature_matrix(df, x_axis, y_axis, use_all_features, opening_counts, variant_counts)
+    return scaler.fit_transform(X), scaler
+
+def _add_center(X_sample, centers, rng):
+    """Warm start for one more cluster: splits the cluster with the largest squared error on the sample.
+
+    The new center is a k-means++ pick among that cluster's sample points.
+    """
+    if sparse.issparse(X_sample):
+        norms = np.asarray(X_sample.multiply(X_sample).sum(axis=1)).ravel()
+    else:
+        norms = (X_sample ** 2).sum(axis=1)
+    distances = norms[:, None] - 2 * np.asarray(X_sample @ centers.T) + (centers ** 2).sum(axis=1)[None, :]
+    nearest = distances.argmin(axis=1)
+    weights = np.maximum(distances.min(axis=1), 0)
+    target = np.bincount(nearest, weights=weights, minlength=len(centers)).argmax()
+    weights = np.where(nearest == target, weights, 0)
+    chosen = X_sample[rng.choice(len(weights), p=weights / weights.sum())]
+    chosen = chosen.toarray() if sparse.issparse(chosen) else chosen[None, :]
+    return np.vstack([centers, chosen])
+
+def sweep_kmeans(df, k_values, x_axis="avg_elo", y_axis="avg_opponent_elo", use_all_features=False,
+                 opening_counts=None, variant_counts=None, engine="kmeans", sample_size=SILHOUETTE_SAMPLE_SIZE,
+                 progress=None):
+    """Fits every k in k_values on one scaled matrix and scores each fit.
+
+    Fits run in increasing k. Each one starts from the previous fit's centers
+    plus one that splits its worst cluster (see _add_center) instead of a
+    fresh k-means++ initialisation.
+    Silhouette is computed on one random sample of at most sample_size players,
+    shared by every k, and sklearn's chunked distance work is capped at
+    SWEEP_WORKING_MEMORY MB, so memory stays bounded however many players
+    there are. Returns a list of {"k", "inertia", "silhouette_score"}.
+    """
+    if engine not in KMEANS_ENGINES:
+        raise ValueError(f"Unknown k-means engine: {engine}")
+    progress = progress or (lambda stage: None)
+    k_values = sorted(set(k_values))
+    logger.info("Sweeping KMeans over k=%s (%s)", k_values, engine)
+    X_scaled, _ = _scaled_features(df, x_axis, y_axis, use_all_features, opening_counts, variant_counts)
+    num_players = X_scaled.shape[0]
+    if k_values[0] < 2 or k_values[-1] >= num_players:
+        raise ValueError(f"k must be between 2 and {num_players - 1}.")
+    rng = np.random.default_rng(42)
+    sample = np.sort(rng.choice(num_players, min(sample_size, num_players), replace=False))
+    X_sample = X_scaled[sample]
+
+    results = []
+    centers = None
+    with config_context(working_memory=SWEEP_WORKING_MEMORY):
+        for k in k_values:
+            progress(f"k={k}")
+            while centers is not None and len(centers) < k:
+                centers = _add_center(X_sample, centers, rng)
+            kmeans = KMEANS_ENGINES[engine](k, "k-means++" if centers is None else centers)
+            kmeans.fit(X_scaled)
+            centers = kmeans.cluster_centers_
+            labels = kmeans.predict(X_sample)
+            results.append({
+                "k": k,
+                "inertia": float(kmeans.inertia_),
+                "silhouette_score": float(silhouette_score(X_sample, labels)) if len(set(labels)) > 1 else None
+            })
+            logger.info("k=%d inertia=%.1f silhouette=%s", k, results[-1]["inertia"], results[-1]["silhouette_score"])
+    return results
+
+def perform_kmeans(df, num_clusters, x_axis="avg_elo", y_axis="avg_opponent_elo", use_all_features=False,
+                   opening_counts=None, variant_counts=None, engine="kmeans", progress=None):
+    model = ClusterModel(num_clusters, x_axis, y_axis, use_all_features, engine)
+    return model.fit(df, opening_counts, variant_counts, progress)
+
+def _cluster_sums(X, labels, num_clusters):
+    """Sums the rows of X by cluster label; returns a dense (num_clusters, features) array."""
+    indicator = sparse.csr_matrix((np.ones(len(labels)), (labels, np.arange(len(labels)))),
+                                  shape=(num_clusters, X.shape[0]))
+    sums = indicator @ X
+    return sums.toarray() if sparse.issparse(sums) else np.asarray(sums)
+
+def _changed_rows(X_old, X_new):
+    """Returns the positions of rows that differ between two matrices of the same shape."""
+    if sparse.issparse(X_old):
+        diff = (X_new - X_old).tocsr()
+        diff.eliminate_zeros()
+        return np.flatnonzero(diff.getnnz(axis=1))
+    return np.flatnonzero((X_new != X_old).any(axis=1))
+
+class ClusterModel:
+    """A k-means clustering of the players that follows new games without a full refit.
+
+    fit() clusters from scratch and keeps what later updates need: the fitted
+    scaler and PCA projection, the scaled matrix, the labels and the sum and
+    size of every cluster. update() takes the features re-aggregated after
+    games were appended. Only players whose feature rows changed, and new
+    players, are re-assigned: each leaves its old cluster and joins the nearest
+    centroid, so the centroids move by the changed points alone. The summaries
+    are then rebuilt from the labels. Scaling and projection stay as fitted, so
+    update() refits instead every REFIT_EVERY updates, once more than
+    REFIT_DRIFT of the players have been re-assigned since the last fit, and
+    when new openings or variants add feature columns.
+    """
+
+    def __init__(self, num_clusters, x_axis="avg_elo", y_axis="avg_opponent_elo", use_all_features=False,
+                 engine="kmeans"):
+        if engine not in KMEANS_ENGINES:
+            raise ValueError(f"Unknown k-means engine: {engine}")
+        self.num_clusters = num_clusters
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+        self.use_all_features = use_all_features
+        self.engine = engine
+        self.updates = 0
+        self.moved_since_fit = 0
+
+    def _vocabularies(self, opening_counts, variant_counts):
+        if not self.use_all_features:
+            return None
+        return tuple(counts.vocabulary if counts is not None else None for counts in (opening_counts, variant_counts))
+
+    def fit(self, df, opening_counts=None, variant_counts=None, progress=None):
+        """Clusters df from scratch and returns the result dict served by /api/kmeans."""
+        logger.info("Performing KMeans clustering with %d clusters (%s)", self.num_clusters, self.engine)
+        progress = progress or (lambda stage: None)
+        progress("clustering")
+        X, scaler = _feature_matrix(df, self.x_axis, self.y_axis, self.use_all_features,
+                                    opening_counts, variant_counts)
+        X_scaled = scaler.fit_transform(X)
+        kmeans = KMEANS_ENGINES[self.engine](self.num_clusters)
+        labels = kmeans.fit_predict(X_scaled)
+
+        progress("reducing")
+        logger.info("Using PCA for dimensionality reduction")
+        reducer = PCA(n_components=2, random_state=42)
+        self.reduced = reducer.fit_transform(X_scaled)
+
+        self.reducer = reducer
+        self.scaler = scaler
+        self.features = df
+        self.opening_counts = opening_counts
+        self.variant_counts = variant_counts
+        self.vocabularies = self._vocabularies(opening_counts, variant_counts)
+        self.X_scaled = X_scaled
+        self.labels = labels
+        self.centers = kmeans.cluster_centers_
+        self.sums = _cluster_sums(X_scaled, labels, self.num_clusters)
+        self.sizes = np.bincount(labels, minlength=self.num_clusters)
+        self.updates = 0
+        self.moved_since_fit = 0
+        return self.result(progress)
+
+    def update(self, df, opening_counts=None, variant_counts=None, progress=None):
+        """Brings the clustering up to date with re-aggregated features and returns the new result.
+
+        df must extend the fitted features: the same players in the same
+        order, then any new ones, as aggregate_player_features returns them
+        after games are appended. Anything else gets a full refit.
+        """
+        progress = progress or (lambda stage: None)
+        num_old = len(self.features)
+        players = df["player"].to_numpy()
+        if self.updates + 1 >= REFIT_EVERY:
+            reason = "periodic refit"
+        elif len(df) < num_old or not (players[:num_old] == self.features["player"].to_numpy()).all():
+            reason = "players changed"
+        elif self._vocabularies(opening_counts, variant_counts) != self.vocabularies:
+            reason = "new feature columns"
+        else:
+            reason = None
+        if reason is None:
+            progress("clustering")
+            X, _ = _feature_matrix(df, self.x_axis, self.y_axis, self.use_all_features,
+                                   opening_counts, variant_counts)
+            X_scaled = self.scaler.transform(X)
+            changed = _changed_rows(self.X_scaled, X_scaled[:num_old])
+            moved = np.concatenate([changed, np.arange(num_old, len(df))])
+            if self.moved_since_fit + len(moved) > REFIT_DRIFT * len(df):
+                reason = "drift"
+        if reason is not None:
+            logger.info("Refitting %d-cluster model (%s)", self.num_clusters, reason)
+            return self.fit(df, opening_counts, variant_counts, progress)
+
+        k = self.num_clusters
+        old_labels = self.labels[changed]
+        sums = self.sums - _cluster_sums(self.X_scaled[changed], old_labels, k)
+        sizes = self.sizes - np.bincount(old_labels, minlength=k)
+        # A cluster emptied by the departures keeps its last centroid.
+        centers = np.where(sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], self.centers)
+        new_labels = pairwise_distances_argmin(X_scaled[moved], centers)
+        sums += _cluster_sums(X_scaled[moved], new_labels, k)
+        sizes += np.bincount(new_labels, minlength=k)
+        self.centers = np.where(sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], centers)
+        self.sums, self.sizes = sums, sizes
+
+        labels = np.concatenate([self.labels, np.zeros(len(df) - num_old, dtype=self.labels.dtype)])
+        labels[moved] = new_labels
+        reduced = np.vstack([self.reduced, np.zeros((len(df) - num_old, 2))])
+        if len(moved):
+            reduced[moved] = self.reducer.transform(X_scaled[moved])
+        logger.info("Updated %d-cluster model: %d players re-assigned, %d switched cluster",
+                    k, len(moved), int((old_labels != new_labels[:len(changed)]).sum()))
+
+        self.features = df
+        self.opening_counts = opening_counts
+        self.variant_counts = variant_counts
+        self.X_scaled = X_scaled
+        self.labels = labels
+        self.reduced = reduced
+        self.updates += 1
+        self.moved_since_fit += len(moved)
+        return self.result(progress)
+
+    def result(self, progress=None):
+        """Builds the result dict (summaries, profiles, per-cluster stats) from the current labels."""
+        progress = progress or (lambda stage: None)
+        labels = self.labels
+        centroids = self.centers
+        if not self.scaler.with_mean:
+            # Report centroids in standardized coordinates, as for dense features.
+            centroids = centroids - self.scaler.mean_ / self.scaler.scale_
+        df = self.features.copy()
+        df["cluster"] = labels
+
+        cluster_colors = sns.color_palette("viridis", self.num_clusters).as_hex()
+
+        progress("scoring")
+        sample_size = SILHOUETTE_SAMPLE_SIZE if len(labels) > SILHOUETTE_SAMPLE_SIZE else None
+        sil_score = silhouette_score(self.X_scaled, labels, sample_size=sample_size, random_state=42)
+
+        df["dim1"] = self.reduced[:, 0]
+        df["dim2"] = self.reduced[:, 1]
+
+        progress("summarizing")
+        cluster_summary = df.groupby("cluster").agg(
+            avg_elo=("avg_elo", "mean"),
+            avg_opponent_elo=("avg_opponent_elo", "mean"),
+            player_count=("player", "count")
+        ).reset_index().to_dict(orient="records")
+        for summary in cluster_summary:
+            summary["cluster_color"] = cluster_colors[int(summary["cluster"])]
+
+        numeric_cols = df.select_dtypes("number").columns
+        cluster_profiles = df.groupby("cluster")[numeric_cols].mean().to_dict(orient="index")
+        global_means = df[numeric_cols].mean()
+        cluster_key = {}
+        for cluster, profile in cluster_profiles.items():
+            key_info = {}
+            for col, val in profile.items():
+                key_info[col] = "High" if val > global_means[col] else "Low"
+            cluster_key[cluster] = key_info
+
+        detailed_cluster_stats = {}
+        for cluster in sorted(df["cluster"].unique()):
+            cluster_df = df[df["cluster"] == cluster]
+            avg_games = cluster_df["games"].mean()
+            avg_elo = cluster_df["avg_elo"].mean()
+            avg_opponent_elo = cluster_df["avg_opponent_elo"].mean()
+            members = (labels == cluster).nonzero()[0]
+            avg_game_types = _average_counts(self.variant_counts, members)
+            avg_opening_counts = _average_counts(self.opening_counts, members)
+            detailed_cluster_stats[cluster] = {
+                "avg_games": avg_games,
+                "avg_elo": avg_elo,
+                "avg_opponent_elo": avg_opponent_elo,
+                "avg_game_types": avg_game_types,
+                "avg_opening_counts": avg_opening_counts,
+                "cluster_color": cluster_colors[int(cluster)]
+            }
+        logger.info("KMeans clustering complete. Silhouette score: %.4f", sil_score)
+
+        cluster_profiles = {str(k): v for k, v in cluster_profiles.items()}
+        cluster_key = {str(k): v for k, v in cluster_key.items()}
+        detailed_cluster_stats = {str(k): v for k, v in detailed_cluster_stats.items()}
+
+        available_features = df.columns.tolist()
+
+        return {
+            "clusters": labels.tolist(),
+            "silhouette_score": sil_score,
+            "player_features": df,
+            "centroids": centroids.tolist(),
+            "dimension_reduction": "pca",
+            "plot_type": "scatter",
+            "cluster_summary": cluster_summary,
+            "cluster_profiles": cluster_profiles,
+            "cluster_key": cluster_key,
+            "detailed_cluster_stats": detailed_cluster_stats,
+            "available_features": available_features  # Include available features
         }
-    logger.info("KMeans clustering complete. Silhouette score: %.4f", sil_score)
-    
-    cluster_profiles = {str(k): v for k, v in cluster_profiles.items()}
-    cluster_key = {str(k): v for k, v in cluster_key.items()}
-    detailed_cluster_stats = {str(k): v for k, v in detailed_cluster_stats.items()}
-    
-    available_features = df.columns.tolist()
-
-    return {
-        "clusters": labels.tolist(),
-        "silhouette_score": sil_score,
-        "player_features": df.to_dict(orient="records"),
-        "centroids": kmeans.cluster_centers_.tolist(),
-        "dimension_reduction": "pca",
-        "plot_type": "scatter",
-        "scatter_plot": plot_base64,
-        "cluster_summary": cluster_summary,
-        "cluster_profiles": cluster_profiles,      
-        "cluster_key": cluster_key,                    
-        "detailed_cluster_stats": detailed_cluster_stats,
-        "available_features": available_features  # Include available features
-    }
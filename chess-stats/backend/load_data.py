@@ -1,10 +1,49 @@
 import os
-import chess.pgn
+import sys
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 import logging
+from functools import partial
+from collections import namedtuple
+from pgn_reader import iter_games, map_shards, open_pgn, is_compressed
+from player_index import PlayerIndex
+from time_index import TimeIndex, TIME_COLUMN
+from openings import OpeningHierarchy, add_opening_columns, OPENING_COLUMNS
 
-df_games = None
+# df_games and everything derived from it, replaced as a whole by each load so
+# that readers never pair the indexes of one load with the table of another.
+# meta is the cache metadata (None when loaded without the cache).
+Dataset = namedtuple("Dataset", ["games", "player_counts", "player_index", "time_index", "opening_hierarchy", "meta"])
+dataset = None
 PGN_FILE = os.path.join("chess-stats/datasets", "example3.pgn")
+CACHE_DIR = os.path.join("chess-stats", "cache")
+CACHE_VERSION = 5
+TAIL_WINDOW = 1 << 16
+
+# Compact df_games schema. White and Black share one player dictionary, so
+# their category codes double as player IDs.
+PLAYER_COLUMNS = ["White", "Black"]
+CATEGORY_COLUMNS = ["Event", "EventType", "Result", "ECO", "Opening", "TimeControl", "Termination", "Variant"]
+# df_games columns as parsed, in build_game_record order.
+GAME_COLUMNS = ["Event", "EventType", "Site", "White", "Black", "Result", "UTCDate", "UTCTime", "WhiteElo",
+                "BlackElo", "WhiteRatingDiff", "BlackRatingDiff", "ECO", "Opening", "TimeControl",
+                "Termination", "Moves", "Variant"]
+INT_COLUMNS = {
+    "WhiteElo": "int16",
+    "BlackElo": "int16",
+    "WhiteRatingDiff": "int16",
+    "BlackRatingDiff": "int16",
+    "Moves": "uint16"
+}
+try:
+    import pyarrow  # noqa: F401
+    # Site is unique per game, so a dictionary would not help; Arrow strings
+    # avoid one Python object per row.
+    SITE_DTYPE = "string[pyarrow]"
+except ImportError:
+    SITE_DTYPE = object
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -28,49 +67,374 @@ def get_variant(time_control):
     else:
         return "Bullet"
 
-def load_dataset(pgn_file_path=PGN_FILE):
-    """Loads all games from the PGN file into a global DataFrame."""
-    global df_games
+def build_game_record(headers, moves):
+    """Builds one df_games row from a game's headers and its mainline ply count."""
+    time_control = headers.get("TimeControl", "0+0")
+    variant = get_variant(time_control)
+    event = headers.get("Event", "Unknown")
+    event_type = event.split()[1] if len(event.split()) > 1 else "Unknown"
+    return {
+        "Event": event,
+        "EventType": event_type,
+        "Site": headers.get("Site", "Unknown"),
+        "White": headers.get("White", "Unknown"),
+        "Black": headers.get("Black", "Unknown"),
+        "Result": headers.get("Result", ""),
+        "UTCDate": headers.get("UTCDate", "Unknown"),
+        "UTCTime": headers.get("UTCTime", "Unknown"),
+        "WhiteElo": int(headers.get("WhiteElo", 0)) if headers.get("WhiteElo", "0").isdigit() else 0,
+        "BlackElo": int(headers.get("BlackElo", 0)) if headers.get("BlackElo", "0").isdigit() else 0,
+        "WhiteRatingDiff": int(headers.get("WhiteRatingDiff", 0)) if headers.get("WhiteRatingDiff", "0").isdigit() else 0,
+        "BlackRatingDiff": int(headers.get("BlackRatingDiff", 0)) if headers.get("BlackRatingDiff", "0").isdigit() else 0,
+        "ECO": headers.get("ECO", "Unknown"),
+        "Opening": headers.get("Opening", "Unknown"),
+        "TimeControl": time_control,
+        "Termination": headers.get("Termination", "Unknown"),
+        "Moves": moves,
+        "Variant": variant
+    }
+
+def parse_games(pgn_file, header_only=False):
+    """Parses every game in an open PGN handle into a DataFrame of df_games rows."""
     games_list = []
+    for headers, moves in iter_games(pgn_file, header_only=header_only):
+        games_list.append(build_game_record(headers, moves))
+        if len(games_list) % 1000 == 0:
+            logging.info(f"Loaded {len(games_list)} games so far...")
+    return pd.DataFrame(games_list, columns=GAME_COLUMNS)
+
+def _hash_range(pgn_file_path, start, end):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(pgn_file_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+def _chain_hash(previous, segment_hash):
+    return hashlib.blake2b((previous + segment_hash).encode(), digest_size=16).hexdigest()
+
+def pgn_fingerprint(pgn_file_path, header_only=False, segments=None):
+    """Identifies a PGN file by path, size, mtime and content hash.
+
+    The content hash chains the hashes of the byte segments ingested so far
+    (segments lists their end offsets), so appending a segment only hashes
+    the new bytes.
+    """
+    stat = os.stat(pgn_file_path)
+    segments = segments or [stat.st_size]
+    sha, start = "", 0
+    for end in segments:
+        sha = _chain_hash(sha, _hash_range(pgn_file_path, start, end))
+        start = end
+    return {
+        "version": CACHE_VERSION,
+        "path": os.path.abspath(pgn_file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "segments": segments,
+        "sha": sha,
+        "tail_sha": _hash_range(pgn_file_path, max(stat.st_size - TAIL_WINDOW, 0), stat.st_size),
+        "header_only": header_only
+    }
+
+def count_players(df):
+    """Number of games per player, counting both colours, most active first.
+
+    Counts the shared player codes, then sorts them in first-appearance order
+    exactly as value_counts does on plain strings, so ties come out the same.
+    """
+    codes = np.concatenate([df["White"].cat.codes.to_numpy(), df["Black"].cat.codes.to_numpy()])
+    players, first_seen, counts = np.unique(codes, return_index=True, return_counts=True)
+    appearance = np.argsort(first_seen)
+    names = df["White"].cat.categories[players[appearance]].astype(object)
+    return pd.Series(counts[appearance], index=names, name="count").sort_values(ascending=False)
+
+def cache_paths(pgn_file_path, cache_dir=CACHE_DIR):
+    """Returns the metadata path and the file name prefix for a PGN file's cache.
+
+    The prefix carries a short hash of the absolute path, so PGNs with the
+    same file name in different directories get separate caches.
+    """
+    path_hash = hashlib.blake2b(os.path.abspath(pgn_file_path).encode("utf-8"), digest_size=4).hexdigest()
+    name = f"{os.path.basename(pgn_file_path)}.{path_hash}"
+    return os.path.join(cache_dir, f"{name}.meta.json"), name
+
+def read_cache_meta(pgn_file_path, cache_dir=CACHE_DIR):
+    meta_path, _ = cache_paths(pgn_file_path, cache_dir)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def cache_status(meta, pgn_file_path, header_only=False):
+    """Returns "fresh", "append" (the PGN only grew since) or "stale" for a cache entry."""
+    if (meta is None or meta.get("version") != CACHE_VERSION
+            or meta.get("path") != os.path.abspath(pgn_file_path) or meta.get("header_only") != header_only):
+        return "stale"
+    stat = os.stat(pgn_file_path)
+    # Cheap checks first so a changed file is never hashed in full.
+    if stat.st_size == meta["size"] and stat.st_mtime_ns == meta["mtime_ns"]:
+        fingerprint = pgn_fingerprint(pgn_file_path, header_only, meta["segments"])
+        return "fresh" if fingerprint["sha"] == meta["sha"] else "stale"
+    if is_compressed(pgn_file_path):
+        return "stale"
+    tail_start = max(meta["size"] - TAIL_WINDOW, 0)
+    if stat.st_size > meta["size"] and _hash_range(pgn_file_path, tail_start, meta["size"]) == meta["tail_sha"]:
+        return "append"
+    return "stale"
+
+def read_cached_dataset(meta, cache_dir=CACHE_DIR):
+    """Reads the cached df_games parts and player counts described by meta."""
+    parts = [pd.read_parquet(os.path.join(cache_dir, part)) for part in meta["parts"]]
+    df = compact_games(concat_games(parts) if len(parts) > 1 else parts[0])
+    return df, read_cached_counts(meta, cache_dir)
+
+def read_cached_counts(meta, cache_dir=CACHE_DIR):
+    counts = pd.read_parquet(os.path.join(cache_dir, meta["players"]))["games"]
+    counts.index.name = None
+    return counts
+
+def write_cached_dataset(df, counts, meta, cache_dir=CACHE_DIR):
+    """Writes df as the next cache part, replaces the player counts and commits meta."""
+    meta_path, name = cache_paths(meta["path"], cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    part = f"{name}.{len(meta['parts'])}.parquet"
+    players = f"{name}.players.parquet"
+    # The first part is written even when empty, so the cache always records the schema.
+    write_part = not df.empty or not meta["parts"]
+    parts = meta["parts"] + [part] if write_part else meta["parts"]
+    try:
+        if write_part:
+            df.to_parquet(os.path.join(cache_dir, part))
+        counts.rename("games").to_frame().to_parquet(os.path.join(cache_dir, players + ".tmp"))
+    except ImportError:
+        logging.warning("pyarrow is not installed, skipping the dataset cache")
+        return
+    os.replace(os.path.join(cache_dir, players + ".tmp"), os.path.join(cache_dir, players))
+    meta = dict(meta, parts=parts, players=players)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    logging.info(f"Cached {len(df)} new games for {name}")
+
+def parse_pgn_file(pgn_file_path, header_only=False, workers=1, start=0):
+    """Parses the games from byte offset start onwards, unfiltered and indexed from 0."""
+    if (workers == 1 or is_compressed(pgn_file_path)) and start == 0:
+        with open_pgn(pgn_file_path) as pgn_file:
+            return parse_games(pgn_file, header_only=header_only)
+    shards = map_shards(pgn_file_path, partial(parse_games, header_only=header_only), workers, start)
+    shards = [shard for shard in shards if not shard.empty]
+    return pd.concat(shards, ignore_index=True) if shards else pd.DataFrame(columns=GAME_COLUMNS)
+
+def filter_games(df):
+    df.dropna(inplace=True)  
+    df = df[(df['WhiteElo'] != 0) & (df['BlackElo'] != 0)]  
+    return compact_games(df)
+
+def align_categories(frames, columns):
+    """Gives the categorical columns of all frames one shared category dictionary, in place.
+
+    Existing categories keep their codes; categories first seen in later
+    columns or frames are appended.
+    """
+    categories = frames[0][columns[0]].cat.categories
+    for frame in frames:
+        for col in columns:
+            new = frame[col].cat.categories
+            categories = categories.append(new[~new.isin(categories)])
+    for frame in frames:
+        for col in columns:
+            if not frame[col].cat.categories.equals(categories):
+                frame[col] = frame[col].cat.set_categories(categories)
+
+def compact_games(df):
+    """Converts df_games to the compact schema: categorical strings, a shared
+    player dictionary, 16-bit ratings and move counts, parsed UTCDate
+    (datetime64) and UTCTime (timedelta64) columns and their sum as
+    UTCDateTime (datetime64), and the MainOpening and ECOFamily categories
+    derived from Opening and ECO. Already compact columns are left alone.
+    An empty df gets the same dtypes, with no categories.
+    """
+    # Parquet reads an empty categorical back as object, derived columns included.
+    present = [col for col in OPENING_COLUMNS if col in df.columns]
+    dtypes = {col: "category" for col in PLAYER_COLUMNS + CATEGORY_COLUMNS + present
+              if not isinstance(df[col].dtype, pd.CategoricalDtype)}
+    dtypes.update({col: dtype for col, dtype in INT_COLUMNS.items() if df[col].dtype != dtype})
+    if df["Site"].dtype != SITE_DTYPE:
+        dtypes["Site"] = SITE_DTYPE
+    df = df.astype(dtypes)
+    align_categories([df], PLAYER_COLUMNS)
+    if df["UTCDate"].dtype == object:
+        df["UTCDate"] = pd.to_datetime(df["UTCDate"], format="%Y.%m.%d", errors="coerce")
+    if df["UTCTime"].dtype == object:
+        df["UTCTime"] = pd.to_timedelta(df["UTCTime"], errors="coerce")
+    if TIME_COLUMN not in df.columns:
+        df[TIME_COLUMN] = df["UTCDate"] + df["UTCTime"]
+    return add_opening_columns(df)
+
+def concat_games(frames):
+    """Concatenates compact df_games frames without falling back to object columns."""
+    # Shallow copies: aligning replaces whole columns, so the frames passed in
+    # are left as they were and pd.concat makes the only copy of the data.
+    frames = [frame.copy(deep=False) for frame in frames if not frame.empty]
+    align_categories(frames, PLAYER_COLUMNS)
+    for col in CATEGORY_COLUMNS + OPENING_COLUMNS:
+        align_categories(frames, [col])
+    return pd.concat(frames)
+
+def appended_games(previous, current):
+    """Returns the rows of current's df_games appended after previous's, or None if it is not an extension.
+
+    load_dataset only adds cache segments when it appends to the games it
+    had; a full parse starts again from one segment.
+    """
+    if previous is None or previous.meta is None or current.meta is None:
+        return None
+    segments = previous.meta["segments"]
+    if (current.meta["path"] != previous.meta["path"] or len(current.meta["segments"]) <= len(segments)
+            or current.meta["segments"][:len(segments)] != segments):
+        return None
+    return current.games.iloc[len(previous.games):]
+
+def _publish_dataset(games, counts, meta, previous=None):
+    """Builds the indexes for games and publishes them together with it as dataset.
+
+    previous is a Dataset whose games are the leading rows of games; its
+    indexes are extended with the rows after them instead of rebuilt.
+    """
+    global dataset
+    if previous is None:
+        indexes = PlayerIndex(games), TimeIndex(games), OpeningHierarchy(games)
+    else:
+        indexes = (PlayerIndex(games, previous.player_index), TimeIndex(games, previous.time_index),
+                   OpeningHierarchy(games, previous.opening_hierarchy))
+    dataset = Dataset(games, counts, *indexes, meta)
+    return dataset
+
+def load_dataset(pgn_file_path=PGN_FILE, header_only=False, workers=1, cache_dir=CACHE_DIR):
+    """Loads all games from the PGN file, publishes them as dataset and returns df_games.
+
+    With header_only=True the tag pairs are read directly and moves are counted
+    from the movetext instead of replaying every game with chess.pgn. With
+    workers > 1 the file is split on game boundaries and the shards are parsed
+    in a process pool, then concatenated in file order. Compressed archives
+    (.gz, .bz2, .xz, .zst) are decompressed as a stream on a single core.
+
+    The filtered result is cached in cache_dir (None disables it) and reused
+    while the PGN is unchanged. When the PGN has only grown since, just the
+    new tail is parsed and appended, both in memory (if this file is already
+    loaded) and as a new cache part. player_counts is recounted; player_index,
+    time_index and opening_hierarchy are extended with the new games when they
+    were loaded, and built for the whole df_games otherwise.
+    """
     if not os.path.exists(pgn_file_path):
         raise FileNotFoundError(f"PGN file not found at: {pgn_file_path}")
-    with open(pgn_file_path, "r", encoding="utf-8") as pgn_file:
-        game_count = 0
-        while True:
-            game = chess.pgn.read_game(pgn_file)
-            if game is None:
-                break
-            headers = game.headers
-            moves = len(list(game.mainline_moves()))
-            time_control = headers.get("TimeControl", "0+0")
-            variant = get_variant(time_control)
-            event = headers.get("Event", "Unknown")
-            event_type = event.split()[1] if len(event.split()) > 1 else "Unknown"
-            games_list.append({
-                "Event": event,
-                "EventType": event_type,
-                "Site": headers.get("Site", "Unknown"),
-                "White": headers.get("White", "Unknown"),
-                "Black": headers.get("Black", "Unknown"),
-                "Result": headers.get("Result", ""),
-                "UTCDate": headers.get("UTCDate", "Unknown"),
-                "UTCTime": headers.get("UTCTime", "Unknown"),
-                "WhiteElo": int(headers.get("WhiteElo", 0)) if headers.get("WhiteElo", "0").isdigit() else 0,
-                "BlackElo": int(headers.get("BlackElo", 0)) if headers.get("BlackElo", "0").isdigit() else 0,
-                "WhiteRatingDiff": int(headers.get("WhiteRatingDiff", 0)) if headers.get("WhiteRatingDiff", "0").isdigit() else 0,
-                "BlackRatingDiff": int(headers.get("BlackRatingDiff", 0)) if headers.get("BlackRatingDiff", "0").isdigit() else 0,
-                "ECO": headers.get("ECO", "Unknown"),
-                "Opening": headers.get("Opening", "Unknown"),
-                "TimeControl": time_control,
-                "Termination": headers.get("Termination", "Unknown"),
-                "Moves": moves,
-                "Variant": variant
-            })
-            game_count += 1
-            if game_count % 1000 == 0:
-                logging.info(f"Loaded {game_count} games so far...")
-    df_games = pd.DataFrame(games_list)
-    df_games.dropna(inplace=True)  
-    df_games = df_games[(df_games['WhiteElo'] != 0) & (df_games['BlackElo'] != 0)]  
-    logging.info(f"Loaded {len(df_games)} games from {pgn_file_path}")
-    return df_games
+    if not cache_dir:
+        games = filter_games(parse_pgn_file(pgn_file_path, header_only, workers))
+        logging.info(f"Loaded {len(games)} games from {pgn_file_path}")
+        return _publish_dataset(games, count_players(games), None).games
+
+    current = dataset
+    in_memory = (current is not None and current.meta is not None
+                 and current.meta["path"] == os.path.abspath(pgn_file_path)
+                 and current.meta["header_only"] == header_only)
+    meta = current.meta if in_memory else read_cache_meta(pgn_file_path, cache_dir)
+    stat = os.stat(pgn_file_path)
+    if in_memory and stat.st_size == meta["size"] and stat.st_mtime_ns == meta["mtime_ns"]:
+        return current.games
+    status = cache_status(meta, pgn_file_path, header_only)
+    if in_memory:
+        games, counts = current.games, current.player_counts
+    elif status != "stale":
+        games, counts = read_cached_dataset(meta, cache_dir)
+        logging.info(f"Loaded {len(games)} games from cache for {pgn_file_path}")
+    if status == "fresh":
+        return _publish_dataset(games, counts, meta).games
+
+    if status == "append":
+        new_games = parse_pgn_file(pgn_file_path, header_only, workers, start=meta["size"])
+        new_games.index += meta["games"]
+        raw_count = len(new_games)
+        new_games = filter_games(new_games) if raw_count else new_games
+        meta = dict(
+            meta,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            segments=meta["segments"] + [stat.st_size],
+            sha=_chain_hash(meta["sha"], _hash_range(pgn_file_path, meta["size"], stat.st_size)),
+            tail_sha=_hash_range(pgn_file_path, max(stat.st_size - TAIL_WINDOW, 0), stat.st_size),
+            games=meta["games"] + raw_count
+        )
+        if not new_games.empty:
+            games = concat_games([games, new_games])
+            # Ties are ordered by first appearance across the whole table, which
+            # the old counts (already sorted by count) no longer record, so the
+            # counts are redone over all games: one pass over the player codes.
+            counts = count_players(games)
+        logging.info(f"Appended {len(new_games)} new games from {pgn_file_path}")
+        previous = current if in_memory else None
+    else:
+        for part in (meta or {}).get("parts", []):
+            if os.path.exists(os.path.join(cache_dir, part)):
+                os.remove(os.path.join(cache_dir, part))
+        fingerprint = pgn_fingerprint(pgn_file_path, header_only)
+        games = parse_pgn_file(pgn_file_path, header_only, workers)
+        meta = dict(fingerprint, games=len(games), parts=[])
+        games = filter_games(games)
+        counts = count_players(games)
+        new_games = games
+        previous = None
+        logging.info(f"Loaded {len(games)} games from {pgn_file_path}")
+    write_cached_dataset(new_games, counts, meta, cache_dir)
+    return _publish_dataset(games, counts, read_cache_meta(pgn_file_path, cache_dir), previous).games
+
+def shared_table_path(meta, shared_dir):
+    _, name = cache_paths(meta["path"], shared_dir)
+    kind = "headers" if meta["header_only"] else "full"
+    return os.path.join(shared_dir, f"{name}.{kind}.{meta['sha'][:16]}.arrow")
+
+
+def load_shared_dataset(pgn_file_path=PGN_FILE, shared_dir=None, header_only=False, workers=1, cache_dir=CACHE_DIR):
+    """Loads df_games from a memory-mapped table in shared_dir that server worker processes share.
+
+    The first process to take the lock loads the dataset with load_dataset and
+    writes it out as an Arrow IPC file named after the PGN fingerprint. Every
+    process, that one included, then maps the file, so the column data is held
+    once in the page cache however many workers there are. player_counts comes
+    from the Parquet cache; player_index, time_index and opening_hierarchy are
+    built per process.
+    """
+    # Imported here: shared.py needs fcntl and pyarrow, which loading without sharing does not.
+    from shared import file_lock, write_shared_table, open_shared_table
+    if not cache_dir:
+        raise ValueError("Sharing the dataset needs the Parquet cache (cache_dir) for its fingerprint")
+    os.makedirs(shared_dir, exist_ok=True)
+    _, name = cache_paths(pgn_file_path, shared_dir)
+    with file_lock(os.path.join(shared_dir, f"{name}.lock")):
+        meta = read_cache_meta(pgn_file_path, cache_dir)
+        if (cache_status(meta, pgn_file_path, header_only) != "fresh"
+                or not os.path.exists(shared_table_path(meta, shared_dir))):
+            load_dataset(pgn_file_path, header_only, workers, cache_dir)
+            meta = dataset.meta
+            path = shared_table_path(meta, shared_dir)
+            prefix = os.path.basename(path)[:-len(".arrow")].rsplit(".", 1)[0] + "."
+            for old in os.listdir(shared_dir):
+                # Workers still mapping an old table keep it until they reload.
+                if old.startswith(prefix) and old.endswith(".arrow"):
+                    os.remove(os.path.join(shared_dir, old))
+            write_shared_table(dataset.games, path)
+        games = open_shared_table(shared_table_path(meta, shared_dir))
+    logging.info(f"Mapped {len(games)} shared games for {pgn_file_path}")
+    return _publish_dataset(games, read_cached_counts(meta, cache_dir), meta).games
+
+if __name__ == "__main__":
+    # Parses the PGN on all cores into the cache the server then reads, e.g.
+    #   python chess-stats/backend/load_data.py chess-stats/datasets/example3.pgn
+    logging.basicConfig(level=logging.INFO)
+    load_dataset(sys.argv[1] if len(sys.argv) > 1 else PGN_FILE, header_only=True, workers=os.cpu_count())
@@ -1,101 +1,160 @@
-import re
-import pandas as pd
+import numpy as np
 import logging
+from scipy import sparse
+from scipy.special import expit
+import sklearn
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.metrics import accuracy_score
-from personalized_stats_alg import get_detailed_stats
 
 logger = logging.getLogger(__name__)
 
+# Processes that run the cross-validation folds side by side (-1: one per core).
+CV_JOBS = -1
+# lbfgs works on the sparse matrix directly and, with a few hundred columns, converges
+# in far fewer passes than saga over millions of games.
+LOGISTIC_SOLVER = "lbfgs"
+
+# Describes the features prepare_logistic_data builds and how the model is fitted; change it
+# when either changes, so that models stored for the old schema are retrained.
+LOGISTIC_SCHEMA = f"difference,num_moves,opening_family;{LOGISTIC_SOLVER};sklearn {sklearn.__version__}"
+
 def prepare_logistic_data(df):
+    """Builds the design matrix of decisive games in one vectorized pass.
+
+    Returns (X, labels, feature_list). X is a sparse CSR matrix with the
+    rating difference, the number of moves and a one-hot column per opening
+    family except the first (as pd.get_dummies(drop_first=True) would).
+    labels is 1 where White won.
+    """
     logger.info("Preparing logistic regression data...")
-    valid_games = df[df["Result"].isin(["1-0", "0-1"])].copy()
-    features = []
-    labels = []
-    for idx, row in valid_games.iterrows():
-        whiteElo = row["WhiteElo"]
-        blackElo = row["BlackElo"]
-        diff = whiteElo - blackElo
-        opening = re.split(r'[:#,]', row["Opening"])[0].strip()
-        num_moves = row["Moves"]
-        features.append({"difference": diff, "opening": opening, "num_moves": num_moves})
-        labels.append(1 if row["Result"] == "1-0" else 0)
-        if idx % 1000 == 0:
-            logger.debug(f"Processed game index: {idx}")
-    df_features = pd.DataFrame(features)
-    df_encoded = pd.get_dummies(df_features, columns=["opening"], drop_first=True)
-    logger.info("Logistic regression data prepared with shape: %s", df_encoded.shape)
-    return df_encoded, labels
+    valid_games = df[df["Result"].isin(["1-0", "0-1"])]
+    # Opening families are the MainOpening codes stored at ingest, renumbered
+    # in name order as pd.get_dummies would order the columns.
+    mains = valid_games["MainOpening"]
+    order = np.argsort(mains.cat.categories.to_numpy(), kind="stable")
+    families = mains.cat.categories.to_numpy()[order]
+    family_of_category = np.empty(len(order), dtype=np.int64)
+    family_of_category[order] = np.arange(len(order))
+    row_family = family_of_category[mains.cat.codes.to_numpy()]
+    used, column = np.unique(row_family, return_inverse=True)
+    num_games = len(valid_games)
+
+    difference = valid_games["WhiteElo"].to_numpy(dtype=np.float64) - valid_games["BlackElo"].to_numpy(dtype=np.float64)
+    numeric = sparse.csr_matrix(np.column_stack([difference, valid_games["Moves"].to_numpy(dtype=np.float64)]))
+    dummies = column > 0
+    one_hot = sparse.csr_matrix(
+        (np.ones(dummies.sum()), (np.flatnonzero(dummies), column[dummies] - 1)),
+        shape=(num_games, max(len(used) - 1, 0))
+    )
+    X = sparse.hstack([numeric, one_hot], format="csr")
+    labels = (valid_games["Result"] == "1-0").to_numpy(dtype=np.int64)
+    feature_list = ["difference", "num_moves"] + [f"opening_{name}" for name in families[used[1:]]]
+    logger.info("Logistic regression data prepared with shape: %s", X.shape)
+    return X, labels, feature_list
 
 def train_logistic_model(df):
     logger.info("Training logistic regression model...")
-    df_encoded, labels = prepare_logistic_data(df)
-    scaler = StandardScaler()
-    X = scaler.fit_transform(df_encoded)
+    X, labels, feature_list = prepare_logistic_data(df)
+    # Centering would densify X; the intercept absorbs the shift, so the fitted coefficients are the same.
+    scaler = StandardScaler(with_mean=False)
+    X = scaler.fit_transform(X)
     X_train, X_test, y_train, y_test = train_test_split(X, labels, test_size=0.2, random_state=42)
-    model = LogisticRegression(max_iter=1000)
+    model = LogisticRegression(max_iter=1000, solver=LOGISTIC_SOLVER)
     model.fit(X_train, y_train)
     train_acc = accuracy_score(y_train, model.predict(X_train))
     test_acc = accuracy_score(y_test, model.predict(X_test))
-    cv_scores = cross_val_score(model, X, labels, cv=5)
+    cv_scores = cross_val_score(LogisticRegression(max_iter=1000, solver=LOGISTIC_SOLVER), X, labels, cv=5,
+                                n_jobs=CV_JOBS)
     feature_importance = model.coef_[0]
-    feature_list = df_encoded.columns.tolist()
     metrics = {
         "train_accuracy": train_acc,
         "test_accuracy": test_acc,
         "cv_accuracy": cv_scores.mean(),
         "feature_importance": dict(zip(feature_list, feature_importance)),
         "num_features": len(feature_list),
-        "num_training_samples": len(X_train),
-        "num_testing_samples": len(X_test)
+        "num_training_samples": X_train.shape[0],
+        "num_testing_samples": X_test.shape[0]
     }
     logger.info("Model trained. Test accuracy: %.4f", test_acc)
     return model, scaler, feature_list, metrics
 
-def predict_logistic(model, scaler, feature_list, df_games, player1, player2):
-    logger.info("Fetching player data and making logistic regression prediction...")
+class LogisticPredictor:
+    """A trained model compiled for scoring one pairing at a time.
+
+    The scaler is folded into the model's weights and intercept, so a
+    comparison is a single dot product over raw feature rows. Column positions
+    are looked up once, and each player's part of a row (rating, games, opening
+    columns) is cached by username until clear() is called.
+    """
+
+    def __init__(self, model, scaler, feature_list):
+        self.positions = {name: i for i, name in enumerate(feature_list)}
+        scale = scaler.scale_ if scaler.scale_ is not None else 1.0
+        mean = scaler.mean_ if scaler.with_mean else 0.0
+        self.weights = model.coef_[0] / scale
+        self.bias = model.intercept_[0] - np.sum(mean * self.weights)
+        self._difference = self.positions["difference"]
+        self._num_moves = self.positions["num_moves"]
+        self._players = {}
+
+    def clear(self):
+        """Drops the cached player vectors, e.g. after the games changed."""
+        self._players = {}
+
+    def player_vector(self, username, stats):
+        vector = self._players.get(username)
+        if vector is None:
+            columns = [self.positions.get(f"opening_{op['name']}") for op in stats.get("most_common_openings", [])]
+            vector = (stats["average_rating"], stats["total_games"],
+                      np.array([c for c in columns if c is not None], dtype=np.intp))
+            self._players[username] = vector
+        return vector
+
+    def predict_pair(self, player1, player1_stats, player2, player2_stats):
+        """Scores both orientations in one call; returns (player 1 predicted to win, player 2 predicted to win)."""
+        rating1, games1, openings1 = self.player_vector(player1, player1_stats)
+        rating2, games2, openings2 = self.player_vector(player2, player2_stats)
+        X = np.zeros((2, len(self.weights)))
+        X[0, self._difference], X[1, self._difference] = rating1 - rating2, rating2 - rating1
+        X[0, self._num_moves], X[1, self._num_moves] = games1, games2
+        X[0, openings1] = 1
+        X[1, openings2] = 1
+        pred1, pred2 = X @ self.weights + self.bias > 0
+        return bool(pred1), bool(pred2)
+
+    def win_probabilities(self, usernames, stats):
+        """Returns the (n, n) matrix of predicted probabilities that player i beats player j.
+
+        stats maps each username to its detailed stats. A row's score is the
+        player's own terms minus the difference weight times the opponent's
+        rating, so the whole matrix is one outer subtraction. The diagonal is NaN.
+        """
+        vectors = [self.player_vector(username, stats[username]) for username in usernames]
+        ratings = np.array([rating for rating, _, _ in vectors], dtype=np.float64)
+        games = np.array([num_games for _, num_games, _ in vectors], dtype=np.float64)
+        openings = np.array([self.weights[columns].sum() for _, _, columns in vectors])
+        difference_weight = self.weights[self._difference]
+        own = difference_weight * ratings + self.weights[self._num_moves] * games + openings + self.bias
+        probabilities = expit(own[:, None] - difference_weight * ratings[None, :])
+        np.fill_diagonal(probabilities, np.nan)
+        return probabilities
+
+def predict_logistic(predictor, player1, player2, player1Stats, player2Stats):
+    """Builds the /compare_players prediction from both players' detailed stats (see get_detailed_stats)."""
     try:
-        player1Stats = get_detailed_stats(df_games, player1)
-        player2Stats = get_detailed_stats(df_games, player2)
         if "error" in player1Stats or "error" in player2Stats:
             return {"error": "Error fetching player statistics."}
 
-        def create_feature_row(p_stats, o_stats):
-            diff = p_stats["average_rating"] - o_stats["average_rating"]
-            row = {col: 0 for col in feature_list}
-            row["difference"] = diff
-            row["num_moves"] = p_stats["total_games"]
-
-            for op in p_stats.get("most_common_openings", []):
-                col = f"opening_{op['name']}"
-                if col in row: row[col] = 1
-            return row
-
-        base_row1 = create_feature_row(player1Stats, player2Stats)
-        base_row2 = create_feature_row(player2Stats, player1Stats)
-        df_input1 = pd.DataFrame([base_row1])
-        df_input2 = pd.DataFrame([base_row2])
-        X_input1 = scaler.transform(df_input1)
-        X_input2 = scaler.transform(df_input2)
-        pred1 = model.predict(X_input1)[0]
-        pred2 = model.predict(X_input2)[0]
-        result1 = "Player 1 wins" if pred1 == 1 else "Player 2 wins"
-        result2 = "Player 2 wins" if pred2 == 1 else "Player 1 wins"
-        overall_winner = "Player 1" if pred1 == 1 else "Player 2"
-
-        feat_imp = model.coef_[0]
-        fc1 = {f: imp * val for f, imp, val in zip(feature_list, feat_imp, X_input1[0])}
-        fc2 = {f: imp * val for f, imp, val in zip(feature_list, feat_imp, X_input2[0])}
-        sorted_fc1 = sorted(fc1.items(), key=lambda x: abs(x[1]), reverse=True)
-        sorted_fc2 = sorted(fc2.items(), key=lambda x: abs(x[1]), reverse=True)
-        short_fc1 = sorted_fc1[:5]
-        short_fc2 = sorted_fc2[:5]
+        pred1, pred2 = predictor.predict_pair(player1, player1Stats, player2, player2Stats)
+        result1 = "Player 1 wins" if pred1 else "Player 2 wins"
+        result2 = "Player 2 wins" if pred2 else "Player 1 wins"
+        overall_winner = "Player 1" if pred1 else "Player 2"
 
         overall_agnostic = "Player 1 wins" if player1Stats["average_rating"] > player2Stats["average_rating"] else "Player 2 wins"
 
-        def opening_predictions(p_stats, base_row):
+        def opening_predictions(p_stats):
             predictions = []
             top_openings = p_stats.get("most_common_openings", [])[:5]
             for op in top_openings:
@@ -104,10 +163,9 @@ def predict_logistic(model, scaler, feature_list, df_games, player1, player2):
                 predictions.append({"opening": op["name"], "wins": wins, "losses": losses})
             return predictions
 
-        op_preds1 = opening_predictions(player1Stats, base_row1)
-        op_preds2 = opening_predictions(player2Stats, base_row2)
+        op_preds1 = opening_predictions(player1Stats)
+        op_preds2 = opening_predictions(player2Stats)
 
-        logger.info("Logistic regression prediction: %s", overall_winner)
         return {
             "result1": result1,
             "result2": result2,
@@ -0,0 +1,64 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stored versions kept per model name; older ones are removed when a new one is saved.
+KEEP_VERSIONS = 3
+
+
+def model_fingerprint(data_sha, schema):
+    """Identifies a model by the data it was trained on and the feature schema it expects."""
+    return hashlib.sha256(f"{data_sha}\n{schema}".encode("utf-8")).hexdigest()
+
+
+def _versions(store_dir, name):
+    # Stored versions of a model, newest first.
+    if not os.path.isdir(store_dir):
+        return []
+    paths = [os.path.join(store_dir, f) for f in os.listdir(store_dir)
+             if f.startswith(f"{name}.") and f.endswith(".pkl")]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def save_model(store_dir, name, bundle):
+    """Writes bundle (a dict with a "fingerprint" key) as a new version of the named model."""
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, f"{name}.{bundle['fingerprint'][:16]}.pkl")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    for old in _versions(store_dir, name)[KEEP_VERSIONS:]:
+        os.remove(old)
+    logger.info("Saved %s model %s", name, path)
+    return path
+
+
+def load_model(store_dir, name, fingerprint=None):
+    """Returns the stored version of the named model for fingerprint, else the newest one, else None.
+
+    Callers compare the returned bundle's "fingerprint" to tell the two cases
+    apart. Versions that cannot be read (e.g. pickled by an incompatible
+    library version) are skipped.
+    """
+    versions = _versions(store_dir, name)
+    if fingerprint is not None:
+        exact = os.path.join(store_dir, f"{name}.{fingerprint[:16]}.pkl")
+        if exact in versions:
+            versions.remove(exact)
+            versions.insert(0, exact)
+    for path in versions:
+        start = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                bundle = pickle.load(f)
+        except Exception:
+            logger.warning("Could not load stored model %s", path, exc_info=True)
+            continue
+        logger.info("Loaded %s model %s in %.1fms", name, path, (time.perf_counter() - start) * 1000)
+        return bundle
+    return None
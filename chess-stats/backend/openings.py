@@ -0,0 +1,135 @@
+import re
+import bisect
+import logging
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Opening names read "Main opening: Variation, Subvariation" (a "#" numbers
+# repeated names), so the main opening is everything before the first separator.
+OPENING_SEPARATORS = re.compile(r"[:#,]")
+
+# Levels of the opening hierarchy, broadest first, and the df_games column
+# holding each level's category code. The variation level is the full
+# Opening name.
+LEVELS = ("family", "opening", "variation")
+LEVEL_COLUMNS = {"family": "ECOFamily", "opening": "MainOpening", "variation": "Opening"}
+# The category columns add_opening_columns derives at ingest.
+OPENING_COLUMNS = ["MainOpening", "ECOFamily"]
+
+
+@lru_cache(maxsize=None)
+def main_opening(name):
+    """Returns the main opening of a full opening name, e.g. "Sicilian Defense" for "Sicilian Defense: Najdorf Variation"."""
+    return OPENING_SEPARATORS.split(name)[0].strip()
+
+
+def eco_family(eco):
+    """Returns the ECO volume (A to E) of an ECO code, or the code itself when it is not one."""
+    return eco[:1] if eco[:1] in ("A", "B", "C", "D", "E") else eco
+
+
+def _derived_column(column, derive):
+    # Derives a categorical column from another one per category instead of per row.
+    names = np.array([derive(str(category)) for category in column.cat.categories], dtype=object)
+    categories, inverse = np.unique(names, return_inverse=True)
+    codes = column.cat.codes.to_numpy()
+    derived = np.where(codes >= 0, inverse.ravel()[codes], -1)
+    return pd.Categorical.from_codes(derived, categories=pd.Index(categories))
+
+
+def add_opening_columns(df):
+    """Adds the MainOpening and ECOFamily category columns to a compact df_games, in place."""
+    if "MainOpening" not in df.columns:
+        df["MainOpening"] = _derived_column(df["Opening"], main_opening)
+    if "ECOFamily" not in df.columns:
+        df["ECOFamily"] = _derived_column(df["ECO"], eco_family)
+    return df
+
+
+class OpeningHierarchy:
+    """Lookup tables between the family, opening and variation codes of df_games.
+
+    Stats roll up or drill down by counting the category codes of a coarser
+    or finer level. A variation belongs to exactly one main opening, given
+    by variation_parent. ECO families and openings overlap (one opening can
+    span several ECO codes), so opening_families lists, per opening code,
+    the family codes it was played under.
+    """
+
+    def __init__(self, df, previous=None):
+        """Builds the tables for df. previous, built from df's leading rows,
+        is reused: only the family/opening pairs of the rows after them are
+        looked up.
+        """
+        self.names = {level: df[column].cat.categories for level, column in LEVEL_COLUMNS.items()}
+        self.variation_parent = self.names["opening"].get_indexer(
+            [main_opening(str(name)) for name in self.names["variation"]])
+        start = 0 if previous is None else previous.num_rows
+        self.num_rows = len(df)
+        families = df["ECOFamily"].cat.codes.to_numpy()[start:].astype(np.int64)
+        openings = df["MainOpening"].cat.codes.to_numpy()[start:].astype(np.int64)
+        known = (families >= 0) & (openings >= 0)
+        pairs = np.unique(families[known] * len(self.names["opening"]) + openings[known])
+        self.opening_families = [[] for _ in self.names["opening"]]
+        if previous is not None:
+            for opening, opening_families in enumerate(previous.opening_families):
+                self.opening_families[opening] = list(opening_families)
+        for family, opening in zip(*np.divmod(pairs, len(self.names["opening"]))):
+            if family not in self.opening_families[opening]:
+                bisect.insort(self.opening_families[opening], int(family))
+        logger.info("Built opening hierarchy: %d families, %d openings, %d variations",
+                    *(len(self.names[level]) for level in LEVELS))
+
+    def code(self, level, name):
+        """Returns the code of a named node at level, raising ValueError if there is none."""
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}. Use one of {', '.join(LEVELS)}.")
+        position = self.names[level].get_indexer([name])[0]
+        if position < 0:
+            raise ValueError(f"Unknown {level}: {name}")
+        return int(position)
+
+    def summary(self, df, level, rows=None, parent=None):
+        """Returns games and results per node at level, optionally for some rows and under a parent.
+
+        parent names a node one level up (drill-down). The result has one row
+        per node with games, sorted by games, most played first.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}. Use one of {', '.join(LEVELS)}.")
+
+        def codes_of(column):
+            codes = df[column].cat.codes.to_numpy()
+            return codes if rows is None else codes[rows]
+
+        codes = codes_of(LEVEL_COLUMNS[level])
+        results = codes_of("Result")
+        if parent is not None:
+            depth = LEVELS.index(level)
+            if depth == 0:
+                raise ValueError(f"The {level} level has no parent.")
+            parent_level = LEVELS[depth - 1]
+            keep = codes_of(LEVEL_COLUMNS[parent_level]) == self.code(parent_level, parent)
+            codes, results = codes[keep], results[keep]
+
+        size = len(self.names[level])
+        valid = codes >= 0
+        games = np.bincount(codes[valid], minlength=size)
+        result_names = df["Result"].cat.categories
+        counts = {}
+        for key, result in (("white_wins", "1-0"), ("black_wins", "0-1"), ("draws", "1/2-1/2")):
+            match = result_names.get_indexer([result])[0]
+            counts[key] = np.bincount(codes[valid & (results == match)], minlength=size) if match >= 0 \
+                else np.zeros(size, dtype=np.int64)
+        table = pd.DataFrame({"name": self.names[level].astype(str), "games": games, **counts})
+        if level == "variation":
+            table["opening"] = self.names["opening"].astype(str).to_numpy()[self.variation_parent]
+        elif level == "opening":
+            family_names = self.names["family"].astype(str)
+            table["families"] = [[family_names[f] for f in families] for families in self.opening_families]
+            table["variations"] = np.bincount(self.variation_parent, minlength=size)
+        table = table[table["games"] > 0]
+        return table.sort_values("games", ascending=False, kind="stable").reset_index(drop=True)
@@ -1,12 +1,22 @@
-import re
 import logging
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
-def get_detailed_stats(df, username):
+def get_detailed_stats(df, username, index=None, since=None, until=None):
+    """Computes a player's stats, over their games from since (inclusive) to until (exclusive) if given."""
     logger.info("Computing detailed stats for user: %s", username)
-    user_games = df[(df["White"] == username) | (df["Black"] == username)].copy()
+    if index is not None:
+        # PlayerIndex built on df: only touch this player's rows.
+        user_games = df.iloc[index.rows_for(username, since, until)[0]].copy()
+    else:
+        mask = (df["White"] == username) | (df["Black"] == username)
+        if since is not None:
+            mask &= df["UTCDateTime"] >= since
+        if until is not None:
+            mask &= df["UTCDateTime"] < until
+        user_games = df[mask].copy()
     if user_games.empty:
         logger.warning("No games found for user: %s", username)
         return {"error": f"No games found for user: {username}"}
@@ -23,7 +33,7 @@ def get_detailed_stats(df, username):
     total_games = len(user_games)
     avg_rating = user_games[["WhiteElo", "BlackElo"]].mean().mean()
     
-    user_games["MainOpening"] = user_games["Opening"].apply(lambda x: re.split(r'[:#,]', x)[0].strip())
+    user_games["MainOpening"] = user_games["MainOpening"].astype(str)
     openings_distribution = user_games["MainOpening"].value_counts().to_dict()
     
     most_common_openings = sorted(
@@ -115,3 +125,182 @@ def get_detailed_stats(df, username):
     }
     logger.info("Detailed stats computed for user: %s", username)
     return stats
+
+def _value_counts_order(counts):
+    # Order in which value_counts lists keys that are given in first-appearance
+    # order: pandas sorts with nargsort(ascending=False), i.e. a quicksort on
+    # the reversed counts, reversed back. Reproducing it keeps ties identical.
+    reverse = np.arange(len(counts))[::-1]
+    return reverse[counts[::-1].argsort(kind="quicksort")][::-1]
+
+def _group_counts(player, key, *weights):
+    """Counts the (player, key) pairs of the long rows, in first-appearance order per player.
+
+    Returns the player, key, count and one summed array per weights, sorted
+    by player and then by the long row in which each pair first appeared.
+    """
+    uniques, first, inverse, counts = np.unique(
+        np.stack([player, key]), axis=1, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    order = np.lexsort((first, uniques[0]))
+    sums = [np.bincount(inverse, weights=w, minlength=len(counts))[order].astype(np.int64) for w in weights]
+    return (uniques[0][order], uniques[1][order], counts[order], *sums)
+
+def _segments(sorted_ids, num_ids):
+    offsets = np.zeros(num_ids + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sorted_ids, minlength=num_ids), out=offsets[1:])
+    return offsets
+
+def _ordered_counts(names, counts):
+    order = _value_counts_order(counts)
+    return {names[i]: int(counts[i]) for i in order}
+
+def get_all_detailed_stats(df, usernames):
+    """Computes get_detailed_stats for many players in one vectorized pass.
+
+    df must be the compact df_games (White/Black share one category
+    dictionary). Each player's games become one long (player, colour) row and
+    every statistic is a grouped count or sum over those rows, so the cost is
+    one pass over the players' games instead of one table scan per player.
+    Returns {username: stats} with exactly the dicts get_detailed_stats builds.
+    """
+    logger.info("Computing detailed stats for %d users", len(usernames))
+    players = df["White"].cat.categories
+    ids = players.get_indexer(usernames)
+    wanted = np.zeros(len(players), dtype=bool)
+    wanted[ids[ids >= 0]] = True
+
+    white = df["White"].cat.codes.to_numpy()
+    black = df["Black"].cat.codes.to_numpy()
+    positions = np.arange(len(df))
+    white_rows = wanted[white]
+    # A game against oneself is one row, seen from White, like the mask in get_detailed_stats.
+    black_rows = wanted[black] & (black != white)
+    rows = np.concatenate([positions[white_rows], positions[black_rows]])
+    player = np.concatenate([white[white_rows], black[black_rows]])
+    is_white = np.concatenate([np.ones(white_rows.sum(), dtype=bool), np.zeros(black_rows.sum(), dtype=bool)])
+    order = np.lexsort((rows, player))
+    rows, player, is_white = rows[order], player[order], is_white[order]
+
+    results = df["Result"].astype("category")
+    result = results.cat.codes.to_numpy()[rows]
+    white_won, black_won, draw = (result == code for code in results.cat.categories.get_indexer(["1-0", "0-1", "1/2-1/2"]))
+    # The original counts a decisive game against oneself as both a win and a loss.
+    self_game = white[rows] == black[rows]
+    win = np.where(self_game, white_won | black_won, np.where(is_white, white_won, black_won))
+    loss = np.where(self_game, white_won | black_won, np.where(is_white, black_won, white_won))
+
+    white_elo = df["WhiteElo"].to_numpy()[rows].astype(np.int64)
+    black_elo = df["BlackElo"].to_numpy()[rows].astype(np.int64)
+    user_elo = np.where(is_white, white_elo, black_elo)
+    opponent_elo = np.where(is_white, black_elo, white_elo)
+    opponent = np.where(is_white, black[rows], white[rows])
+    higher = opponent_elo > user_elo
+    lower = opponent_elo < user_elo
+
+    main_names = df["MainOpening"].cat.categories.to_numpy()
+    main = df["MainOpening"].cat.codes.to_numpy()[rows]
+    variants = df["Variant"].astype("category")
+    variant_names = variants.cat.categories
+    variant = variants.cat.codes.to_numpy()[rows]
+    moves = df["Moves"].to_numpy()[rows]
+
+    num_players = len(players)
+    offsets = _segments(player, num_players)
+    def per_player(weights):
+        return np.bincount(player, weights=weights, minlength=num_players)
+    totals = np.diff(offsets)
+    wins, losses, draws = per_player(win), per_player(loss), per_player(draw)
+    white_elo_sum, black_elo_sum, opponent_elo_sum = per_player(white_elo), per_player(black_elo), per_player(opponent_elo)
+    higher_count, higher_wins = per_player(higher), per_player(higher & win)
+    lower_count, lower_wins = per_player(lower), per_player(lower & win)
+
+    op_player, op_main, op_count, op_wins = _group_counts(player, main, win)
+    op_offsets = _segments(op_player, num_players)
+    opp_player, opp_id, opp_count = _group_counts(player, opponent)
+    opp_offsets = _segments(opp_player, num_players)
+    var_player, var_id, var_count, var_wins, var_losses, var_draws = _group_counts(player, variant, win, loss, draw)
+    var_offsets = _segments(var_player, num_players)
+    num_variants = max(len(variant_names), 1)
+    vo_key, vo_main, vo_count = _group_counts(player.astype(np.int64) * num_variants + variant, main)
+    vo_offsets = _segments(vo_key, num_players * num_variants)
+
+    all_stats = {}
+    for username, p in zip(usernames, ids):
+        if p < 0 or totals[p] == 0:
+            logger.warning("No games found for user: %s", username)
+            all_stats[username] = {"error": f"No games found for user: {username}"}
+            continue
+        start, end = offsets[p], offsets[p + 1]
+        total_games = int(totals[p])
+        avg_rating = (white_elo_sum[p] / total_games + black_elo_sum[p] / total_games) / 2
+
+        o_start, o_end = op_offsets[p], op_offsets[p + 1]
+        o_names = main_names[op_main[o_start:o_end]]
+        openings_distribution = _ordered_counts(o_names, op_count[o_start:o_end])
+        most_common_openings = sorted(
+            [{"name": k, "count": v} for k, v in openings_distribution.items()],
+            key=lambda x: x["count"],
+            reverse=True
+        )
+        opening_winrates = [
+            {"name": name, "winrate": (int(w) / int(t)) * 100}
+            for name, w, t in zip(o_names, op_wins[o_start:o_end], op_count[o_start:o_end])
+        ]
+
+        c_start, c_end = opp_offsets[p], opp_offsets[p + 1]
+        most_common_opponent = players[opp_id[c_start:c_end][_value_counts_order(opp_count[c_start:c_end])[0]]]
+
+        variant_stats = {}
+        for i in range(var_offsets[p], var_offsets[p + 1]):
+            v = var_id[i]
+            key = p * num_variants + v
+            v_start, v_end = vo_offsets[key], vo_offsets[key + 1]
+            variant_stats[variant_names[v]] = {
+                "total_games": int(var_count[i]),
+                "wins": int(var_wins[i]),
+                "losses": int(var_losses[i]),
+                "draws": int(var_draws[i]),
+                "openings_distribution": _ordered_counts(main_names[vo_main[v_start:v_end]], vo_count[v_start:v_end])
+            }
+
+        all_stats[username] = {
+            "username": username,
+            "total_games": total_games,
+            "wins": int(wins[p]),
+            "losses": int(losses[p]),
+            "draws": int(draws[p]),
+            "average_rating": int(round(avg_rating)),
+            "openings_distribution": openings_distribution,
+            "most_common_openings": most_common_openings,
+            "opening_winrates": opening_winrates,
+            "game_lengths": moves[start:end].tolist(),
+            "average_opponent_rating": np.float64(opponent_elo_sum[p]) / total_games,
+            "most_common_opponent": most_common_opponent,
+            "higher_elo_wins": int(higher_wins[p]),
+            "higher_elo_losses": int(higher_count[p] - higher_wins[p]),
+            "lower_elo_wins": int(lower_wins[p]),
+            "lower_elo_losses": int(lower_count[p] - lower_wins[p]),
+            "variant_stats": variant_stats
+        }
+    logger.info("Detailed stats computed for %d users", len(usernames))
+    return all_stats
+
+def get_rating_history(df, username, index, since=None, until=None):
+    """Returns a player's rating over time as a DataFrame with one row per timed game, oldest first.
+
+    Columns are time (ISO, UTC), rating and rating_diff (the player's side of
+    WhiteElo/BlackElo and the rating diff columns) and variant. Served from the
+    PlayerIndex built on df, whose per-player rows are already in time order.
+    Returns None if the player has no games.
+    """
+    if index.player_id(username) < 0:
+        return None
+    rows, is_white, times = index.history(username, since, until)
+    return pd.DataFrame({
+        "time": np.datetime_as_string(times, unit="s"),
+        "rating": np.where(is_white, df["WhiteElo"].to_numpy()[rows], df["BlackElo"].to_numpy()[rows]),
+        "rating_diff": np.where(is_white, df["WhiteRatingDiff"].to_numpy()[rows],
+                                df["BlackRatingDiff"].to_numpy()[rows]),
+        "variant": np.asarray(df["Variant"].cat.categories[df["Variant"].cat.codes.to_numpy()[rows]], dtype=object)
+    })
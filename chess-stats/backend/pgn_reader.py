@@ -0,0 +1,260 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import chess.pgn
+
+logger = logging.getLogger(__name__)
+
+TAG_REGEX = chess.pgn.TAG_REGEX
+MOVETEXT_REGEX = chess.pgn.MOVETEXT_REGEX
+
+# Seven tag roster that chess.pgn fills in when a game omits these headers.
+DEFAULT_HEADERS = {
+    "Event": "?",
+    "Site": "?",
+    "Date": "????.??.??",
+    "Round": "?",
+    "White": "?",
+    "Black": "?",
+    "Result": "*",
+}
+
+RESULT_TOKENS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+def _open_zstd(path, mode="rb"):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"Reading {path} needs the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+
+COMPRESSED_OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+    ".zst": _open_zstd,
+}
+
+
+def is_compressed(path):
+    """True if the PGN is a compressed archive that has to be read as one stream."""
+    return os.path.splitext(path)[1].lower() in COMPRESSED_OPENERS
+
+
+def open_pgn(path):
+    """Opens a PGN file for reading as text, decompressing .gz, .bz2, .xz and .zst on the fly."""
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1].lower())
+    if opener is None:
+        return open(path, "r", encoding="utf-8")
+    return io.TextIOWrapper(opener(path, "rb"), encoding="utf-8")
+
+
+def read_game_header_only(handle):
+    """Reads the next game's tag pairs and counts its mainline plies without replaying the board.
+
+    Follows the game boundary rules of chess.pgn.read_game so both readers walk
+    the file identically. Moves are counted from the movetext tokens, so games
+    with illegal moves are not truncated the way chess.pgn would truncate them.
+    Returns (headers, plies) or None at the end of the file.
+    """
+    line = handle.readline().lstrip("\ufeff")
+    while line.isspace() or line.startswith("%") or line.startswith(";"):
+        line = handle.readline()
+    if not line:
+        return None
+
+    headers = dict(DEFAULT_HEADERS)
+    consecutive_empty_lines = 0
+    while line:
+        if line.startswith("%") or line.startswith(";"):
+            line = handle.readline()
+            continue
+        if consecutive_empty_lines < 1 and line.isspace():
+            consecutive_empty_lines += 1
+            line = handle.readline()
+            continue
+        if not line.startswith("["):
+            break
+        consecutive_empty_lines = 0
+        tag_match = TAG_REGEX.match(line)
+        if tag_match:
+            headers[tag_match.group(1)] = tag_match.group(2)
+        line = handle.readline()
+
+    # Ply count of each open (sub)variation, mainline first, mirroring the
+    # board stack chess.pgn keeps while parsing.
+    ply_stack = [0]
+    skip_variation_depth = 0
+    fresh_line = True
+    while line:
+        if fresh_line:
+            if line.startswith("%") or line.startswith(";"):
+                line = handle.readline()
+                continue
+            if line.isspace():
+                break
+        fresh_line = True
+
+        for match in MOVETEXT_REGEX.finditer(line):
+            token = match.group(0)
+            if token.startswith("{"):
+                line = token[1:]
+                while line and "}" not in line:
+                    line = handle.readline()
+                if line:
+                    line = line[line.find("}") + 1:]
+                fresh_line = False
+                break
+            elif token == "(":
+                if skip_variation_depth:
+                    skip_variation_depth += 1
+                elif ply_stack[-1]:
+                    ply_stack.append(ply_stack[-1] - 1)
+            elif token == ")":
+                if skip_variation_depth > 1:
+                    skip_variation_depth -= 1
+                elif skip_variation_depth:
+                    skip_variation_depth = 0
+                    if len(ply_stack) > 1:
+                        ply_stack.pop()
+                elif len(ply_stack) > 1:
+                    ply_stack.pop()
+            elif skip_variation_depth:
+                continue
+            elif token.startswith(";"):
+                break
+            elif token.startswith("$") or token[0] in "?!":
+                continue
+            elif token in RESULT_TOKENS:
+                if len(ply_stack) == 1:
+                    if headers.get("Result", "*") == "*":
+                        headers["Result"] = token
+                else:
+                    # chess.pgn tries to parse it as SAN and skips the variation.
+                    skip_variation_depth = 1
+            else:
+                ply_stack[-1] += 1
+
+        if fresh_line:
+            line = handle.readline()
+
+    return headers, ply_stack[0]
+
+
+def iter_games(handle, header_only=False):
+    """Yields (headers, moves) for every game in an open PGN file."""
+    while True:
+        if header_only:
+            result = read_game_header_only(handle)
+            if result is None:
+                break
+            yield result
+        else:
+            game = chess.pgn.read_game(handle)
+            if game is None:
+                break
+            yield game.headers, len(list(game.mainline_moves()))
+
+
+class ShardHandle:
+    """Text-mode readline() over the byte range [start, end) of a PGN file."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._pos = start
+        self._end = end
+
+    def readline(self):
+        if self._pos >= self._end:
+            return ""
+        line = self._file.readline()
+        self._pos += len(line)
+        return line.decode("utf-8")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _is_game_start(line, prev_line, prev_prev_line):
+    # A game starts at an "[Event " tag after a blank line, unless that blank
+    # line sits between two header blocks (chess.pgn would merge those).
+    return (line.startswith(b"[Event ") and prev_line is not None and not prev_line.strip()
+            and prev_prev_line is not None and not prev_prev_line.startswith(b"["))
+
+
+def find_shard_offsets(path, num_shards, start=0):
+    """Splits a PGN file from start onwards into byte ranges that begin on "[Event " game boundaries."""
+    size = os.path.getsize(path)
+    offsets = [start]
+    with open(path, "rb") as f:
+        for i in range(1, num_shards):
+            target = max(start + (size - start) * i // num_shards, offsets[-1] + 1)
+            if target >= size:
+                break
+            f.seek(target)
+            pos = target + len(f.readline())
+            prev_prev_line, prev_line = None, None
+            line = f.readline()
+            while line and not _is_game_start(line, prev_line, prev_prev_line):
+                prev_prev_line, prev_line = prev_line, line
+                pos += len(line)
+                line = f.readline()
+            if not line:
+                break
+            offsets.append(pos)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def _run_shard(args):
+    path, start, end, func = args
+    with ShardHandle(path, start, end) as handle:
+        return func(handle)
+
+
+def map_shards(path, func, workers=None, start=0):
+    """Runs func(handle) on game-aligned shards of a PGN file in a process pool.
+
+    func must be a picklable top-level function. Only bytes from start onwards
+    are read. Results come back in file order, one per shard. Compressed
+    files are streamed through func as a single shard. The pool is forked, so
+    a process that is already running other threads reads on a single core.
+    """
+    if is_compressed(path):
+        # Compressed streams have no seekable game boundaries.
+        if start:
+            raise ValueError(f"Cannot read {path} from byte offset {start}")
+        with open_pgn(path) as handle:
+            return [func(handle)]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        # Spawned children would re-import the server module and reload the data.
+        logger.warning("fork start method unavailable, reading %s on a single core", path)
+        workers = 1
+    if workers > 1 and threading.active_count() > 1:
+        # A lock another thread holds at fork time (a logging handler's, say)
+        # stays locked forever in the children.
+        logger.warning("Other threads are running, reading %s on a single core", path)
+        workers = 1
+    shards = find_shard_offsets(path, workers, start)
+    tasks = [(path, start, end, func) for start, end in shards]
+    if workers == 1 or len(shards) == 1:
+        return [_run_shard(task) for task in tasks]
+    logger.info("Reading %s in %d shards", path, len(shards))
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("fork")) as executor:
+        return list(executor.map(_run_shard, tasks))
@@ -0,0 +1,100 @@
+import logging
+import numpy as np
+from time_index import TIME_COLUMN, window_bounds
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerIndex:
+    """CSR index from player ID to the df_games row positions of that player's games.
+
+    Player IDs are the codes of the White/Black category dictionary shared by
+    the compact df_games. For player p, rows[offsets[p]:offsets[p + 1]] are
+    their row positions ordered by game time (UTCDateTime, ties in row order),
+    times holds those times and is_white tells which colour they had in each
+    game. Time windows over a player's games are binary searches in times.
+    """
+
+    def __init__(self, df, previous=None):
+        """Indexes df. previous, an index over df's leading rows (with the
+        player dictionary they had then), is reused: only the rows after it
+        are sorted and merged in.
+        """
+        white = df["White"].cat.codes.to_numpy()
+        black = df["Black"].cat.codes.to_numpy()
+        self.players = df["White"].cat.categories
+        self.num_rows = len(df)
+        start = 0 if previous is None else previous.num_rows
+        positions = np.arange(start, len(df), dtype=np.int32 if len(df) < 2**31 else np.int64)
+        white, black = white[start:], black[start:]
+        # A game against oneself is indexed once, as the boolean mask sees it.
+        black_rows = black != white
+        codes = np.concatenate([white, black[black_rows]])
+        rows = np.concatenate([positions, positions[black_rows]])
+        is_white = np.concatenate([np.ones(len(white), dtype=bool), np.zeros(black_rows.sum(), dtype=bool)])
+        times = df[TIME_COLUMN].to_numpy()
+        order = np.lexsort((rows, times[rows], codes))
+        codes, rows, is_white = codes[order], rows[order], is_white[order]
+        counts = np.bincount(codes, minlength=len(self.players))
+        if previous is None:
+            self.rows, self.is_white, self.times = rows, is_white, times[rows]
+        else:
+            at = previous._insert_positions(codes, times[rows])
+            self.rows = np.insert(previous.rows.astype(rows.dtype, copy=False), at, rows)
+            self.is_white = np.insert(previous.is_white, at, is_white)
+            self.times = np.insert(previous.times, at, times[rows])
+            counts[:len(previous.players)] += np.diff(previous.offsets)
+        # In a file written in time order, time order is row order and rows_for need not re-sort.
+        added = times[max(start - 1, 0):]
+        self.chronological = ((previous is None or previous.chronological)
+                              and bool(np.all(added[1:] >= added[:-1])) and not np.isnat(added).any())
+        self.offsets = np.zeros(len(self.players) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        logger.info("Built player index over %d players and %d games (%d new)",
+                    len(self.players), len(df), len(df) - start)
+
+    def _insert_positions(self, codes, times):
+        """Returns where entries sorted by (player, time, row), all for rows
+        after this index's, go in its arrays: after the same player's games
+        up to the same time, and players new to it after everyone else.
+        """
+        at = np.full(len(codes), len(self.rows), dtype=np.int64)
+        known = int(np.searchsorted(codes, len(self.offsets) - 1))
+        players, first = np.unique(codes[:known], return_index=True)
+        # One binary search per player with new games, in that player's segment only.
+        for player, lo, hi in zip(players, first, np.append(first[1:], known)):
+            start, end = self.offsets[player], self.offsets[player + 1]
+            at[lo:hi] = start + np.searchsorted(self.times[start:end], times[lo:hi], side="right")
+        return at
+
+    def player_id(self, username):
+        """Returns the player ID for a username, or -1 if they have no games."""
+        return int(self.players.get_indexer([username])[0])
+
+    def _segment(self, username, since, until):
+        player = self.player_id(username)
+        if player < 0:
+            return 0, 0
+        start, end = self.offsets[player], self.offsets[player + 1]
+        if since is not None or until is not None:
+            lo, hi = window_bounds(self.times[start:end], since, until)
+            start, end = start + lo, start + hi
+        return start, end
+
+    def rows_for(self, username, since=None, until=None):
+        """Returns (row positions, is_white) for a player's games, both sorted by row.
+
+        With since (inclusive) or until (exclusive) only games in that window are returned.
+        """
+        start, end = self._segment(username, since, until)
+        rows, is_white = self.rows[start:end], self.is_white[start:end]
+        if not self.chronological:
+            by_row = np.argsort(rows, kind="stable")
+            rows, is_white = rows[by_row], is_white[by_row]
+        return rows, is_white
+
+    def history(self, username, since=None, until=None):
+        """Returns (row positions, is_white, times) for a player's timed games in the window, by time."""
+        start, end = self._segment(username, None, None)
+        lo, hi = window_bounds(self.times[start:end], since, until)
+        return self.rows[start + lo:start + hi], self.is_white[start + lo:start + hi], self.times[start + lo:start + hi]
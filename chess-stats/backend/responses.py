@@ -0,0 +1,88 @@
+import io
+import gzip
+import logging
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are sent as they are; compressing them gains nothing.
+COMPRESS_MIN_SIZE = 1024
+
+TABLE_FORMATS = {
+    "records": "application/json",
+    "columns": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "msgpack": "application/msgpack",
+}
+
+
+def select_rows(df, fields=None, offset=0, limit=None):
+    """Returns the requested columns of rows [offset, offset + limit) of df, raising ValueError on bad input."""
+    if fields:
+        unknown = [field for field in fields if field not in df.columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(df.columns)}.")
+        df = df[list(fields)]
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative.")
+    return df.iloc[offset:None if limit is None else offset + limit]
+
+
+def table_payload(df, fmt):
+    """Converts a table to JSON-ready records (one dict per row) or columns (one list per column)."""
+    if fmt == "records":
+        return df.to_dict(orient="records")
+    return {column: df[column].tolist() for column in df.columns}
+
+
+def encode_arrow(df, metadata):
+    """Encodes df as an Arrow IPC stream, with the rest of the response (JSON bytes) in the schema metadata."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("The arrow format needs the pyarrow package (pip install pyarrow)")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, response=metadata))
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def encode_msgpack(payload):
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("The msgpack format needs the msgpack package (pip install msgpack)")
+    return msgpack.packb(payload, default=_msgpack_default)
+
+
+def choose_encoding(accept_encodings):
+    """Picks br (when the brotli package is installed) or gzip from a request's Accept-Encoding, else None."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    """Compresses a response body; returns (body, encoding), encoding None if it was left as is."""
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return data, None
+    if encoding == "br":
+        return brotli.compress(data, quality=6), encoding
+    return gzip.compress(data, compresslevel=6, mtime=0), encoding
@@ -1,8 +1,12 @@
 import os
+import time
+import threading
+import hashlib
 import logging
+import contextlib
+from collections import OrderedDict
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import pandas as pd
 from flask_caching import Cache
 
 logging.basicConfig(level=logging.DEBUG,
@@ -12,69 +16,283 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)  
 CORS(app)
 
-cache = Cache(app, config={'CACHE_TYPE': 'simple'})
-
-from load_data import load_dataset, PGN_FILE
-from logistic_regression_alg import train_logistic_model, predict_logistic, prepare_logistic_data
-from kmeans_alg import aggregate_player_features, perform_kmeans
-from personalized_stats_alg import get_detailed_stats
-
-logger.info("Loading dataset...")
-df_games = load_dataset(PGN_FILE) 
-logger.info("Dataset loaded successfully.")
-logger.debug("df_games sample:\n%s", df_games.head())
-
-logger.info("Precomputing logistic regression model...")
-try:
-    model, scaler, feature_list, metrics = train_logistic_model(df_games)
-    cache.set("logistic_model", (model, scaler, feature_list, metrics), timeout=60*60*24)  
-    logger.info("Logistic regression model cached successfully.")
-except Exception as e:
-    logger.exception("Error precomputing logistic regression model")
-
-logger.info("Precomputing k-means clustering...")
-try:
-    df_features = aggregate_player_features(df_games)
-    common_params = [
-        (3, "avg_elo", "avg_opponent_elo"),
-        (4, "avg_elo", "avg_opponent_elo"),
-        (5, "avg_elo", "avg_opponent_elo")
-    ]
-    for num_clusters, x_axis, y_axis in common_params:
-        kmeans_result = perform_kmeans(df_features, num_clusters, x_axis, y_axis)
-        cache_key = f"kmeans_{num_clusters}_{x_axis}_{y_axis}"
-        cache.set(cache_key, kmeans_result, timeout=60*60*24)  
-    logger.info("K-means clustering cached successfully.")
-except Exception as e:
-    logger.exception("Error precomputing k-means clustering")
-
-logger.info("Precomputing personalized statistics for example usernames...")
-try:
-    all_users = pd.concat([df_games["White"], df_games["Black"]])
-    example_users = all_users.value_counts().head(5).index.tolist()
-    for username in example_users:
-        stats = get_detailed_stats(df_games, username)
-        cache.set(f"chess_stats_{username}", stats, timeout=60*60*24)  
-    cache.set("example_users", example_users, timeout=60*60*24)  
-    logger.info("Personalized statistics cached successfully.")
-except Exception as e:
-    logger.exception("Error precomputing personalized statistics")
-
-logger.info("Precomputing top players...")
-try:
-    all_users = pd.concat([df_games["White"], df_games["Black"]])
-    game_counts = all_users.value_counts()
-    threshold = 50  
+# With CHESS_STATS_SHARED_DIR set, worker processes map one shared copy of the
+# games and keep computed results in a file-system cache they all read, e.g.
+#   CHESS_STATS_SHARED_DIR=/var/tmp/chess-stats gunicorn -w 4 server:app
+SHARED_DIR = os.environ.get("CHESS_STATS_SHARED_DIR")
+if SHARED_DIR:
+    cache = Cache(app, config={'CACHE_TYPE': 'filesystem', 'CACHE_DIR': os.path.join(SHARED_DIR, "results"),
+                               'CACHE_THRESHOLD': 100000})
+else:
+    cache = Cache(app, config={'CACHE_TYPE': 'simple'})
+
+import load_data
+from load_data import load_dataset, load_shared_dataset, appended_games, PGN_FILE
+from logistic_regression_alg import (train_logistic_model, predict_logistic, prepare_logistic_data, LogisticPredictor,
+                                     LOGISTIC_SCHEMA)
+from kmeans_alg import (aggregate_player_features, update_player_features, sweep_kmeans, render_cluster_plot, ClusterModel,
+                        KMEANS_ENGINES, PLOT_FORMATS, SILHOUETTE_SAMPLE_SIZE)
+from personalized_stats_alg import get_detailed_stats, get_all_detailed_stats, get_rating_history
+from jobs import JobQueue
+from responses import (TABLE_FORMATS, select_rows, table_payload, encode_arrow, encode_msgpack,
+                       choose_encoding, compress)
+from warmup import Warmup
+if SHARED_DIR:
+    # Only sharing needs shared.py, and with it fcntl and pyarrow.
+    from shared import file_lock
+from time_index import parse_window
+from openings import LEVELS as OPENING_LEVELS
+from model_store import model_fingerprint, save_model, load_model
+
+jobs = JobQueue(store=cache if SHARED_DIR else None)
+
+player_features, opening_counts, variant_counts = None, None, None
+
+# Fitted models are stored here by fingerprint and reloaded at startup instead of retrained.
+MODEL_DIR = os.path.join(SHARED_DIR or load_data.CACHE_DIR, "models")
+# The model /compare_players serves: a dict of model, scaler, feature_list, metrics,
+# fingerprint, the compiled predictor and its metrics as a JSON fragment. It is only
+# ever replaced by a newer model, never dropped.
+logistic_model = None
+# Stats of the players compared so far and their JSON, by username, until the games change.
+comparison_players = {}
+
+# Fitted clusterings by cache key, most recently used last, so that refresh_dataset can
+# update them incrementally when games are appended instead of clustering from scratch.
+CLUSTER_MODEL_LIMIT = 8
+cluster_models = OrderedDict()
+models_lock = threading.Lock()
+refresh_lock = threading.Lock()
+
+# With CHESS_STATS_REFRESH_SECONDS set, the PGN is checked that often for appended games.
+REFRESH_SECONDS = int(os.environ.get("CHESS_STATS_REFRESH_SECONDS", 0))
+
+def precompute_lock(name):
+    """Lets one worker at a time run a precompute stage, so the others find its results cached."""
+    if not SHARED_DIR:
+        return contextlib.nullcontext()
+    return file_lock(os.path.join(SHARED_DIR, f"{name}.lock"))
+
+def load_games():
+    """Loads (or refreshes) load_data.dataset: df_games and its indexes, published as one object."""
+    logger.info("Loading dataset...")
+    # This runs on the warm-up and refresh threads while requests are served,
+    # and forking a parser pool from a threaded process can deadlock the
+    # children, so the PGN is parsed on one core here. Build the cache on all
+    # cores beforehand with: python chess-stats/backend/load_data.py
+    if not SHARED_DIR:
+        load_dataset(PGN_FILE, header_only=True, workers=1)
+    else:
+        load_shared_dataset(PGN_FILE, SHARED_DIR, header_only=True, workers=1)
+        with precompute_lock("dataset"):
+            data = load_data.dataset
+            # Results computed for another version of the data are stale. Other workers
+            # may still serve the landing pages from them, so their replacements are
+            # built first and stored right after the clear.
+            if cache.get("dataset_sha") != data.meta["sha"]:
+                replacements = landing_entries(data)
+                cache.clear()
+                cache.set_many(replacements, timeout=60*60*24)
+                cache.set("dataset_sha", data.meta["sha"], timeout=0)
+    logger.info("Dataset loaded successfully.")
+    logger.debug("df_games sample:\n%s", load_data.dataset.games.head())
+
+def example_users_entries(data):
+    """Cache entries for the example usernames: each one's stats, then the list itself."""
+    example_users = data.player_counts.head(5).index.tolist()
+    entries = {f"chess_stats_{username}": stats
+               for username, stats in get_all_detailed_stats(data.games, example_users).items()}
+    entries["example_users"] = example_users
+    return entries
+
+def landing_entries(data):
+    """Cache entries behind the landing pages: the example users with their stats, and the top players."""
+    return dict(example_users_entries(data), top_players=compute_top_players(data.games, data.player_counts))
+
+def precompute_example_users():
+    with precompute_lock("example_users"):
+        if cache.get("example_users") is not None:
+            return
+        logger.info("Precomputing personalized statistics for example usernames...")
+        for key, value in example_users_entries(load_data.dataset).items():
+            cache.set(key, value, timeout=60*60*24)
+        logger.info("Personalized statistics cached successfully.")
+
+def precompute_player_features():
+    global player_features, opening_counts, variant_counts
+    player_features, opening_counts, variant_counts = aggregate_player_features(load_data.dataset.games)
+
+def precompute_top_players():
+    with precompute_lock("top_players"):
+        if cache.get("top_players") is not None:
+            return
+        logger.info("Precomputing top players...")
+        data = load_data.dataset
+        cache.set("top_players", compute_top_players(data.games, data.player_counts), timeout=60*60*24)
+        logger.info("Top players cached successfully.")
+
+def compute_top_players(games, game_counts):
+    threshold = 50
     selected_players = game_counts[game_counts >= threshold].index.tolist()
-    top_players_stats = []
-    for player in selected_players:
-        stats = get_detailed_stats(df_games, player)
-        if "error" not in stats:
-            top_players_stats.append(stats)
-    cache.set("top_players", {"top_players": top_players_stats}, timeout=60*60*24)  
-    logger.info("Top players cached successfully.")
-except Exception as e:
-    logger.exception("Error precomputing top players")
+    all_stats = get_all_detailed_stats(games, selected_players)
+    return {"top_players": [stats for stats in all_stats.values() if "error" not in stats]}
+
+def logistic_fingerprint():
+    meta = load_data.dataset.meta
+    if meta is None:
+        return None
+    return model_fingerprint(meta["sha"], LOGISTIC_SCHEMA)
+
+def precompute_logistic_model():
+    """Loads the stored logistic model for the current data, training one only if none is stored.
+
+    A model stored for other data (or another schema) is served while the
+    right one trains in the background.
+    """
+    fingerprint = logistic_fingerprint()
+    if logistic_model is not None and logistic_model["fingerprint"] == fingerprint:
+        return
+    stored = load_model(MODEL_DIR, "logistic", fingerprint) if fingerprint else None
+    if stored is None:
+        train_and_store_logistic_model(fingerprint)
+        return
+    if logistic_model is None or stored["fingerprint"] == fingerprint:
+        use_logistic_model(stored)
+    if stored["fingerprint"] != fingerprint:
+        logger.info("Stored logistic model is for other data; retraining in the background.")
+        jobs.submit("logistic_model", train_and_store_logistic_model, fingerprint)
+
+def train_and_store_logistic_model(fingerprint, progress=None):
+    with precompute_lock("logistic_model"):
+        # Another worker may have trained it while this one waited for the lock.
+        stored = load_model(MODEL_DIR, "logistic", fingerprint) if fingerprint else None
+        if stored is not None and stored["fingerprint"] == fingerprint:
+            use_logistic_model(stored)
+            return
+        model, scaler, feature_list, metrics = train_logistic_model(load_data.dataset.games)
+        bundle = {
+            "model": model,
+            "scaler": scaler,
+            "feature_list": feature_list,
+            "metrics": metrics,
+            "fingerprint": fingerprint,
+            "schema": LOGISTIC_SCHEMA,
+            "trained": time.time()
+        }
+        if fingerprint:
+            save_model(MODEL_DIR, "logistic", bundle)
+        use_logistic_model(bundle)
+        logger.info("Logistic regression model ready.")
+
+def use_logistic_model(bundle):
+    global logistic_model
+    metrics = bundle["metrics"]
+    model_fields = {
+        "comparison_basis": "Logistic regression prediction",
+        "model_accuracy": metrics["test_accuracy"],
+        "cross_validation_score": metrics["cv_accuracy"],
+        "full_feature_importances": metrics["feature_importance"]
+    }
+    logistic_model = dict(bundle, predictor=LogisticPredictor(bundle["model"], bundle["scaler"], bundle["feature_list"]),
+                          model_json=compact_json(model_fields)[1:-1])
+
+def precompute_kmeans():
+    with precompute_lock("kmeans"):
+        for num_clusters in (3, 4, 5):
+            params = kmeans_params({"num_clusters": num_clusters})
+            cache_key = kmeans_cache_key(**params)
+            if cache.get(cache_key) is None:
+                logger.info("Precomputing k-means clustering with %d clusters...", num_clusters)
+                run_kmeans(cache_key, params)
+    logger.info("K-means clustering cached successfully.")
+
+def refresh_dataset():
+    """Picks up games appended to the PGN and brings what was computed from the old games up to date.
+
+    When games were only appended, the player features are brought up to
+    date from the new games alone (see update_player_features). Clusterings
+    in cluster_models are then updated incrementally (see ClusterModel.update)
+    and cached again; the other cached results are dropped, and example users
+    and top players are recomputed. Replacements are built before the old
+    results are dropped, so those stay served meanwhile. The logistic model
+    keeps serving while a new one trains. Returns whether the data changed.
+    """
+    global player_features, opening_counts, variant_counts
+    with refresh_lock:
+        meta = load_data.dataset.meta
+        stat = os.stat(PGN_FILE)
+        if meta is not None and (stat.st_size, stat.st_mtime_ns) == (meta["size"], meta["mtime_ns"]):
+            return False
+        previous = load_data.dataset
+        old_version = dataset_version()
+        load_games()
+        if dataset_version() == old_version:
+            return False
+        data = load_data.dataset
+        start = time.perf_counter()
+        new_games = appended_games(previous, data)
+        if new_games is not None and player_features is not None:
+            features, openings, variants = update_player_features(player_features, opening_counts, variant_counts,
+                                                                  new_games)
+        else:
+            features, openings, variants = aggregate_player_features(data.games)
+        with models_lock:
+            models = list(cluster_models.items())
+        replacements = {key: model.update(features, openings, variants) for key, model in models}
+        logger.info("Updated %d clusterings for the new games in %.3fs", len(models), time.perf_counter() - start)
+        if not SHARED_DIR:
+            # In shared mode load_games has already replaced these.
+            replacements.update(landing_entries(data))
+        with models_lock:
+            player_features, opening_counts, variant_counts = features, openings, variants
+            if not SHARED_DIR:
+                cache.clear()
+            cache.set_many(replacements, timeout=60*60*24)
+            comparison_players.clear()
+        precompute_example_users()
+        precompute_top_players()
+        if logistic_model is not None:
+            logistic_model["predictor"].clear()
+        precompute_logistic_model()
+        return True
+
+def watch_dataset():
+    warmup.wait()
+    if warmup.status("dataset")["status"] != "done":
+        return
+    while True:
+        time.sleep(REFRESH_SECONDS)
+        try:
+            refresh_dataset()
+        except Exception:
+            logger.exception("Dataset refresh failed")
+
+# Cheap stages behind the landing pages go first; the model and clusterings last.
+warmup = Warmup()
+warmup.add("dataset", load_games, required=True)
+warmup.add("example_users", precompute_example_users)
+warmup.add("player_features", precompute_player_features)
+warmup.add("top_players", precompute_top_players)
+warmup.add("logistic_model", precompute_logistic_model)
+warmup.add("kmeans", precompute_kmeans)
+
+def warming_up(*stages):
+    """Returns an error response while any of the startup stages is unfinished, else None."""
+    for name in stages:
+        stage = warmup.status(name)
+        if stage["status"] == "failed":
+            return jsonify({"error": f"Startup stage {name} failed: {stage['error']}"}), 500
+        if stage["status"] != "done":
+            response = jsonify({"error": "Server is warming up, please retry shortly.",
+                                "warming_up": True, "stage": name, "status": stage["status"]})
+            response.headers["Retry-After"] = "5"
+            return response, 503
+    return None
+
+@app.route("/health", methods=["GET"])
+def health():
+    ready = warmup.ready()
+    return jsonify({"ready": ready, "stages": warmup.stages()}), 200 if ready else 503
 
 @app.route("/chess_stats", methods=["GET"])
 def chess_stats():
@@ -82,24 +300,138 @@ def chess_stats():
     if not username:
         return jsonify({"error": "Username parameter is required"}), 400
     try:
-        cache_key = f"chess_stats_{username}"
-        cached_stats = cache.get(cache_key)
-        if cached_stats:
-            return jsonify(cached_stats)
-        else:
-            stats = get_detailed_stats(df_games, username)
-            if "error" in stats:
-                return jsonify(stats), 404
-            cache.set(cache_key, stats, timeout=60*60*24)  # Cache the computed stats
-            return jsonify(stats)
+        since, until = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("dataset")
+    if pending:
+        return pending
+    try:
+        return cached_json_response(f"chess_stats?username={username}{window_key(since, until)}",
+                                    lambda: player_stats(username, since, until))
     except Exception as e:
         logger.exception("Error in /chess_stats endpoint")
         return jsonify({"error": str(e)}), 500
 
+# Largest number of usernames one /chess_stats/batch request may ask for.
+BATCH_LIMIT = 1000
+
+@app.route("/chess_stats/batch", methods=["POST"])
+def chess_stats_batch():
+    data = request.get_json(silent=True)
+    usernames = data.get("usernames") if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) for u in usernames):
+        return jsonify({"error": "usernames must be a non-empty list of strings"}), 400
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > BATCH_LIMIT:
+        return jsonify({"error": f"At most {BATCH_LIMIT} usernames per request"}), 400
+    try:
+        since, until = parse_window(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("dataset")
+    if pending:
+        return pending
+    try:
+        stats = players_stats(usernames, since, until)
+        return jsonify({
+            "stats": {username: stats[username] for username in usernames if username in stats},
+            "not_found": [username for username in usernames if username not in stats]
+        })
+    except Exception as e:
+        logger.exception("Error in /chess_stats/batch endpoint")
+        return jsonify({"error": str(e)}), 500
+
+def window_key(since, until):
+    """Suffix that tells cache keys for a time window apart; empty for all games."""
+    if since is None and until is None:
+        return ""
+    return f"&since={since}&until={until}"
+
+def games_between(since, until):
+    """df_games restricted to a time window, by binary search in the time index."""
+    data = load_data.dataset
+    if since is None and until is None:
+        return data.games
+    return data.games.iloc[data.time_index.rows_between(since, until)]
+
+def players_stats(usernames, since=None, until=None):
+    """Returns {username: stats} for the usernames that have games, from the cache where possible."""
+    suffix = window_key(since, until)
+    cached_stats = cache.get_many(*[f"chess_stats_{username}{suffix}" for username in usernames])
+    stats = {username: s for username, s in zip(usernames, cached_stats) if s}
+    missing = [username for username in usernames if username not in stats]
+    if missing:
+        # One vectorized pass over df_games (or the window of it) for every user not cached yet.
+        computed = get_all_detailed_stats(games_between(since, until), missing)
+        found = {username: s for username, s in computed.items() if "error" not in s}
+        cache.set_many({f"chess_stats_{username}{suffix}": s for username, s in found.items()}, timeout=60*60*24)
+        stats.update(found)
+    logger.info("Stats for %d users, %d from cache", len(usernames), len(usernames) - len(missing))
+    return stats
+
+def player_stats(username, since=None, until=None):
+    cache_key = f"chess_stats_{username}{window_key(since, until)}"
+    cached_stats = cache.get(cache_key)
+    if cached_stats:
+        return cached_stats, 200
+    data = load_data.dataset
+    stats = get_detailed_stats(data.games, username, data.player_index, since, until)
+    if "error" in stats:
+        return stats, 404
+    cache.set(cache_key, stats, timeout=60*60*24)  # Cache the computed stats
+    return stats, 200
+
+def dataset_version():
+    """Identifies the loaded data for ETags: the PGN fingerprint, or this process's table without a cache."""
+    data = load_data.dataset
+    if data.meta is not None:
+        return data.meta["sha"][:16]
+    return f"{os.getpid()}.{id(data.games):x}"
+
+def result_etag(key):
+    """ETag of the result identified by key, which changes whenever the dataset does."""
+    return f"{dataset_version()}-{hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()}"
+
+def cached_json_response(key, build):
+    """Serves build() -> (payload, status) as JSON for the request identified by key.
+
+    The ETag combines the dataset version with key, so a matching
+    If-None-Match gets a 304 without touching the data. Successful bodies are
+    serialized and compressed once per encoding and then served from the cache.
+    """
+    etag = result_etag(key)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        encoding = choose_encoding(request.accept_encodings)
+        body_key = f"http_{etag}_{encoding}"
+        cached_body = cache.get(body_key)
+        if cached_body is None:
+            payload, status = build()
+            if status != 200:
+                return jsonify(payload), status
+            cached_body = compress(app.json.response(payload).get_data(), encoding)
+            cache.set(body_key, cached_body, timeout=60*60*24)
+        body, encoding = cached_body
+        response = app.response_class(body, mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag, weak=True)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 @app.route("/example_usernames", methods=["GET"])
 def example_usernames():
+    pending = warming_up("example_users")
+    if pending:
+        return pending
     try:
         example_users = cache.get("example_users")
+        if example_users is None:
+            # Dropped by a refresh in another worker and not replaced yet.
+            example_users = load_data.dataset.player_counts.head(5).index.tolist()
         if example_users:
             return jsonify({"examples": example_users})
         else:
@@ -113,13 +445,40 @@ def kmeans_endpoint():
     data = request.get_json()
     if not data:
         return jsonify({"error": "Request body must be JSON."}), 415
-    num_clusters = int(data.get("num_clusters", 3))
-    x_axis_param = data.get("x_axis", "avg_elo")
-    y_axis_param = data.get("y_axis", "avg_opponent_elo")
-    reduction_method = data.get("reduction_method", "pca")
-    plot_type = data.get("plot_type", "scatter")
-    feature_set = data.get("feature_set", "default")
-    use_all_features = feature_set == "all"
+    try:
+        params = kmeans_params(data)
+        options = table_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("player_features")
+    if pending:
+        return pending
+
+    try:
+        cache_key = kmeans_cache_key(**params)
+        cached_result = cache.get(cache_key)
+        if data.get("async"):
+            if cached_result:
+                job_id = jobs.add_result(cached_result)
+            else:
+                job_id = jobs.submit(cache_key, run_kmeans, cache_key, params)
+            job = jobs.get(job_id)
+            return jsonify({"job_id": job_id, "status": job["status"],
+                            "status_url": f"/api/kmeans/jobs/{job_id}"}), 202
+        try:
+            result = cached_result or run_kmeans(cache_key, params)
+            return kmeans_response(result, options)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in /api/kmeans endpoint")
+        return jsonify({"error": str(e)}), 500
+
+def kmeans_params(data):
+    """Reads clustering parameters from a JSON body or query string, raising ValueError if invalid."""
+    engine = data.get("engine", "kmeans")
+    if engine not in KMEANS_ENGINES:
+        raise ValueError(f"Invalid engine. Choose one of: {', '.join(KMEANS_ENGINES)}.")
 
     # Map frontend axis names to DataFrame column names
     axis_mapping = {
@@ -128,71 +487,466 @@ def kmeans_endpoint():
         "games": "games",
         "total_games": "games"
     }
-    x_axis = axis_mapping.get(x_axis_param)
-    y_axis = axis_mapping.get(y_axis_param)
+    x_axis = axis_mapping.get(data.get("x_axis", "avg_elo"))
+    y_axis = axis_mapping.get(data.get("y_axis", "avg_opponent_elo"))
     if not x_axis or not y_axis:
-        return jsonify({"error": "Invalid x_axis or y_axis parameter."}), 400
+        raise ValueError("Invalid x_axis or y_axis parameter.")
+    since, until = parse_window(data)
+    return {
+        "num_clusters": int(data.get("num_clusters", 3)),
+        "x_axis": x_axis,
+        "y_axis": y_axis,
+        "reduction_method": data.get("reduction_method", "pca"),
+        "plot_type": data.get("plot_type", "scatter"),
+        "feature_set": data.get("feature_set", "default"),
+        "engine": engine,
+        "since": since,
+        "until": until
+    }
 
+def int_option(value, name):
+    """Parses an integer given as a JSON number or a string, raising ValueError on anything else."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer.")
     try:
-        cache_key = f"kmeans_{num_clusters}_{x_axis}_{y_axis}_{reduction_method}_{plot_type}_{feature_set}"
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer.")
+
+def table_options(data):
+    """Reads player_features field selection, paging and format from a JSON body or query string."""
+    fmt = data.get("format", "records")
+    if not isinstance(fmt, str) or fmt not in TABLE_FORMATS:
+        raise ValueError(f"Invalid format. Choose one of: {', '.join(TABLE_FORMATS)}.")
+    fields = data.get("fields")
+    if isinstance(fields, str):
+        fields = [field for field in fields.split(",") if field]
+    elif fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) for f in fields)):
+        raise ValueError("fields must be a list of field names or a comma-separated string.")
+    limit = data.get("limit")
+    return {
+        "fields": fields,
+        "offset": int_option(data.get("offset", 0), "offset"),
+        "limit": int_option(limit, "limit") if limit is not None else None,
+        "format": fmt
+    }
+
+def encode_kmeans_result(result, options):
+    """Returns a clustering result as a JSON-ready dict, or as (bytes, mimetype) for arrow and msgpack."""
+    features = select_rows(result["player_features"], options["fields"], options["offset"], options["limit"])
+    offset, limit = options["offset"], options["limit"]
+    body = dict(result, clusters=result["clusters"][offset:None if limit is None else offset + limit])
+    if offset or limit is not None:
+        body["pagination"] = {"offset": offset, "limit": limit, "total": len(result["player_features"])}
+    fmt = options["format"]
+    if fmt == "arrow":
+        del body["player_features"]
+        return encode_arrow(features, app.json.dumps(body).encode("utf-8")), TABLE_FORMATS[fmt]
+    body["player_features"] = table_payload(features, "records" if fmt == "records" else "columns")
+    if fmt == "msgpack":
+        return encode_msgpack(body), TABLE_FORMATS[fmt]
+    return body
+
+def kmeans_response(result, options):
+    encoded = encode_kmeans_result(result, options)
+    if isinstance(encoded, dict):
+        return jsonify(encoded)
+    return app.response_class(encoded[0], mimetype=encoded[1])
+
+def kmeans_cache_key(num_clusters, x_axis, y_axis, reduction_method="pca", plot_type="scatter",
+                     feature_set="default", engine="kmeans", since=None, until=None):
+    return (f"kmeans_{num_clusters}_{x_axis}_{y_axis}_{reduction_method}_{plot_type}_{feature_set}_{engine}"
+            f"{window_key(since, until)}")
+
+def clustering_features(params):
+    """Returns (player_features, opening_counts, variant_counts) for the games in the params' time window."""
+    if params["since"] is None and params["until"] is None:
+        return player_features, opening_counts, variant_counts
+    games = games_between(params["since"], params["until"])
+    if games.empty:
+        raise ValueError("No games in the requested time window.")
+    return aggregate_player_features(games)
+
+def run_kmeans(cache_key, params, progress=None):
+    start = time.perf_counter()
+    current = player_features
+    windowed = params["since"] is not None or params["until"] is not None
+    features, openings, variants = clustering_features(params)
+    model = ClusterModel(params["num_clusters"], params["x_axis"], params["y_axis"], params["feature_set"] == "all",
+                         params["engine"])
+    kmeans_result = model.fit(features, openings, variants, progress)
+    logger.info("Clustering for %s took %.3fs", cache_key, time.perf_counter() - start)
+    with models_lock:
+        # A refresh that landed meanwhile has made this result stale; it is still returned but not kept.
+        # Clusterings of a time window are refit from scratch rather than updated.
+        if windowed and current is player_features:
+            cache.set(cache_key, kmeans_result, timeout=60*60*24)
+        elif current is player_features:
+            cluster_models[cache_key] = model
+            cluster_models.move_to_end(cache_key)
+            while len(cluster_models) > CLUSTER_MODEL_LIMIT:
+                cluster_models.popitem(last=False)
+            cache.set(cache_key, kmeans_result, timeout=60*60*24)
+    return kmeans_result
+
+@app.route("/api/kmeans/plot", methods=["GET"])
+def kmeans_plot():
+    try:
+        params = kmeans_params(request.args)
+        fmt = request.args.get("format", "png")
+        width = int(request.args.get("width", 800))
+        height = int(request.args.get("height", 600))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fmt not in PLOT_FORMATS:
+        return jsonify({"error": f"Invalid format. Choose one of: {', '.join(PLOT_FORMATS)}."}), 400
+    if not (100 <= width <= 4000 and 100 <= height <= 4000):
+        return jsonify({"error": "width and height must be between 100 and 4000 pixels."}), 400
+    pending = warming_up("player_features")
+    if pending:
+        return pending
+
+    try:
+        cache_key = kmeans_cache_key(**params)
+        plot_key = f"plot_{cache_key}_{fmt}_{width}x{height}"
+        # Revalidated like the JSON results, so a refreshed dataset never
+        # leaves browsers showing an old plot.
+        etag = result_etag(plot_key)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            timings = []
+            image = cache.get(plot_key)
+            if image is None:
+                kmeans_result = cache.get(cache_key)
+                if kmeans_result is None:
+                    start = time.perf_counter()
+                    kmeans_result = run_kmeans(cache_key, params)
+                    timings.append(f"cluster;dur={(time.perf_counter() - start) * 1000:.1f}")
+                start = time.perf_counter()
+                features = kmeans_result["player_features"]
+                image = render_cluster_plot(features["dim1"].to_numpy(), features["dim2"].to_numpy(),
+                                            features["cluster"].to_numpy(), fmt, width, height)
+                render_time = time.perf_counter() - start
+                timings.append(f"render;dur={render_time * 1000:.1f}")
+                logger.info("Rendering %s took %.3fs", plot_key, render_time)
+                cache.set(plot_key, image, timeout=60*60*24)
+            response = app.response_class(image, mimetype=PLOT_FORMATS[fmt])
+            if timings:
+                response.headers["Server-Timing"] = ", ".join(timings)
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    except Exception as e:
+        logger.exception("Error in /api/kmeans/plot endpoint")
+        return jsonify({"error": str(e)}), 500
+
+# Bounds on a /api/kmeans/sweep request, which together cap its time and memory.
+SWEEP_MAX_K = 50
+SWEEP_MAX_FITS = 25
+SWEEP_MAX_SAMPLE = 50000
+
+@app.route("/api/kmeans/sweep", methods=["POST"])
+def kmeans_sweep_endpoint():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Request body must be JSON."}), 415
+    try:
+        params = kmeans_params(data)
+        if "k_values" in data:
+            k_values = sorted({int(k) for k in data["k_values"]})
+        else:
+            k_values = list(range(int(data.get("k_min", 2)), int(data.get("k_max", 10)) + 1))
+        sample_size = int(data.get("sample_size", SILHOUETTE_SAMPLE_SIZE))
+        if not k_values or k_values[0] < 2 or k_values[-1] > SWEEP_MAX_K or len(k_values) > SWEEP_MAX_FITS:
+            raise ValueError(f"Choose up to {SWEEP_MAX_FITS} values of k between 2 and {SWEEP_MAX_K}.")
+        if not 100 <= sample_size <= SWEEP_MAX_SAMPLE:
+            raise ValueError(f"sample_size must be between 100 and {SWEEP_MAX_SAMPLE}.")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("player_features")
+    if pending:
+        return pending
+
+    try:
+        cache_key = (f"sweep_{','.join(map(str, k_values))}_{params['x_axis']}_{params['y_axis']}_"
+                     f"{params['feature_set']}_{params['engine']}_{sample_size}"
+                     f"{window_key(params['since'], params['until'])}")
         cached_result = cache.get(cache_key)
-        if cached_result:
-            return jsonify(cached_result)
-        df_features = aggregate_player_features(df_games)
-        kmeans_result = perform_kmeans(df_features, num_clusters, x_axis, y_axis, use_all_features)
-        cache.set(cache_key, kmeans_result, timeout=60*60*24)  
-        return jsonify(kmeans_result)
+        if data.get("async"):
+            if cached_result:
+                job_id = jobs.add_result(cached_result)
+            else:
+                job_id = jobs.submit(cache_key, run_sweep, cache_key, params, k_values, sample_size)
+            job = jobs.get(job_id)
+            return jsonify({"job_id": job_id, "status": job["status"],
+                            "status_url": f"/api/kmeans/jobs/{job_id}"}), 202
+        try:
+            return jsonify(cached_result or run_sweep(cache_key, params, k_values, sample_size))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.exception("Error in /api/kmeans endpoint")
+        logger.exception("Error in /api/kmeans/sweep endpoint")
         return jsonify({"error": str(e)}), 500
 
+def run_sweep(cache_key, params, k_values, sample_size, progress=None):
+    start = time.perf_counter()
+    features, openings, variants = clustering_features(params)
+    sweep = sweep_kmeans(features, k_values, params["x_axis"], params["y_axis"], params["feature_set"] == "all",
+                         openings, variants, params["engine"], sample_size, progress)
+    result = {
+        "sweep": sweep,
+        "sample_size": min(sample_size, len(features)),
+        "feature_set": params["feature_set"],
+        "engine": params["engine"],
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+    cache.set(cache_key, result, timeout=60*60*24)
+    return result
+
+@app.route("/api/kmeans/jobs/<job_id>", methods=["GET"])
+def kmeans_job_status(job_id):
+    try:
+        options = table_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    if job["status"] != "done" or "player_features" not in job["result"]:
+        if job["status"] != "done":
+            del job["result"]
+        return jsonify(job)
+    try:
+        encoded = encode_kmeans_result(job["result"], options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not isinstance(encoded, dict):
+        # Binary formats send the finished result itself rather than the status record.
+        return app.response_class(encoded[0], mimetype=encoded[1])
+    job["result"] = encoded
+    return jsonify(job)
+
 @app.route("/top_players", methods=["GET"])
 def top_players():
+    pending = warming_up("top_players")
+    if pending:
+        return pending
     try:
-        cached_result = cache.get("top_players")
-        if cached_result:
-            return jsonify(cached_result)
-        else:
-            return jsonify({"error": "Top players not found."}), 404
+        sort = request.args.get("sort")
+        order = request.args.get("order", "desc")
+        offset = int_option(request.args.get("offset", 0), "offset")
+        limit = request.args.get("limit")
+        limit = int_option(limit, "limit") if limit is not None else None
+        fields = [field for field in request.args.get("fields", "").split(",") if field]
+        since, until = parse_window(request.args)
+        if sort is not None and sort not in TOP_PLAYER_SORT_FIELDS:
+            raise ValueError(f"Invalid sort field. Choose one of: {', '.join(TOP_PLAYER_SORT_FIELDS)}.")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc.")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must not be negative.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        key = (f"top_players?sort={sort}&order={order}&offset={offset}&limit={limit}&fields={','.join(fields)}"
+               f"{window_key(since, until)}")
+        return cached_json_response(key, lambda: top_players_page(sort, order, offset, limit, fields, since, until))
     except Exception as e:
         logger.exception("Error in /top_players endpoint")
         return jsonify({"error": str(e)}), 500
 
+TOP_PLAYER_SORT_FIELDS = ["username", "total_games", "wins", "losses", "draws", "average_rating",
+                          "average_opponent_rating", "higher_elo_wins", "higher_elo_losses",
+                          "lower_elo_wins", "lower_elo_losses"]
+
+def top_players_page(sort, order, offset, limit, fields, since=None, until=None):
+    # Top players within a time window are ranked on the games in it and computed on first
+    # request; so are all-time top players that a refresh in another worker dropped.
+    cache_key = f"top_players{window_key(since, until)}"
+    cached_result = cache.get(cache_key)
+    if cached_result is None:
+        games = games_between(since, until)
+        cached_result = compute_top_players(games, load_data.count_players(games))
+        cache.set(cache_key, cached_result, timeout=60*60*24)
+    if not cached_result:
+        return {"error": "Top players not found."}, 404
+    players = cached_result["top_players"]
+    if sort is not None:
+        players = sorted(players, key=lambda stats: stats[sort], reverse=order == "desc")
+    page = players[offset:None if limit is None else offset + limit]
+    if fields:
+        page = [{field: stats[field] for field in fields if field in stats} for stats in page]
+    result = {"top_players": page}
+    if offset or limit is not None:
+        result["pagination"] = {"offset": offset, "limit": limit, "total": len(players)}
+    return result, 200
+
+@app.route("/rating_history", methods=["GET"])
+def rating_history():
+    username = request.args.get("username")
+    if not username:
+        return jsonify({"error": "Username parameter is required"}), 400
+    fmt = request.args.get("format", "records")
+    if fmt not in ("records", "columns"):
+        return jsonify({"error": "Invalid format. Choose one of: records, columns."}), 400
+    try:
+        since, until = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("dataset")
+    if pending:
+        return pending
+    try:
+        key = f"rating_history?username={username}&format={fmt}{window_key(since, until)}"
+        return cached_json_response(key, lambda: player_rating_history(username, since, until, fmt))
+    except Exception as e:
+        logger.exception("Error in /rating_history endpoint")
+        return jsonify({"error": str(e)}), 500
+
+def player_rating_history(username, since, until, fmt):
+    data = load_data.dataset
+    history = get_rating_history(data.games, username, data.player_index, since, until)
+    if history is None:
+        return {"error": f"No games found for user: {username}"}, 404
+    return {"username": username, "games": len(history), "history": table_payload(history, fmt)}, 200
+
+# Game counts and results per ECO family (the default level), main opening or
+# variation. parent names a node one level up to drill down into; username and
+# since/until restrict the games.
+@app.route("/openings", methods=["GET"])
+def openings():
+    level = request.args.get("level", "family")
+    parent = request.args.get("parent") or None
+    username = request.args.get("username") or None
+    fmt = request.args.get("format", "records")
+    if level not in OPENING_LEVELS:
+        return jsonify({"error": f"Invalid level. Choose one of: {', '.join(OPENING_LEVELS)}."}), 400
+    if parent is not None and level == OPENING_LEVELS[0]:
+        return jsonify({"error": f"The {level} level has no parent."}), 400
+    if fmt not in ("records", "columns"):
+        return jsonify({"error": "Invalid format. Choose one of: records, columns."}), 400
+    try:
+        since, until = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pending = warming_up("dataset")
+    if pending:
+        return pending
+    try:
+        key = f"openings?level={level}&parent={parent}&username={username}&format={fmt}{window_key(since, until)}"
+        return cached_json_response(key, lambda: opening_summary(level, parent, username, since, until, fmt))
+    except Exception as e:
+        logger.exception("Error in /openings endpoint")
+        return jsonify({"error": str(e)}), 500
+
+def opening_summary(level, parent, username, since, until, fmt):
+    data = load_data.dataset
+    if username is not None:
+        rows, _ = data.player_index.rows_for(username, since, until)
+        if len(rows) == 0:
+            return {"error": f"No games found for user: {username}"}, 404
+    elif since is not None or until is not None:
+        rows = data.time_index.rows_between(since, until)
+    else:
+        rows = None
+    try:
+        summary = data.opening_hierarchy.summary(data.games, level, rows, parent)
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    result = {"level": level, "parent": parent, "openings": table_payload(summary, fmt)}
+    if username is not None:
+        result["username"] = username
+    return result, 200
+
+def compact_json(value):
+    """Serializes value as jsonify does outside debug mode: sorted keys, no spaces."""
+    return app.json.dumps(value, separators=(",", ":"))
+
+def comparison_player(username):
+    """Returns (stats, status, stats as JSON) for /compare_players, kept in comparison_players once found."""
+    entry = comparison_players.get(username)
+    if entry is None:
+        stats, status = player_stats(username)
+        entry = (stats, status, compact_json(stats))
+        if status == 200:
+            comparison_players[username] = entry
+    return entry
+
+# The response is spliced together from JSON fragments, in jsonify's sorted key
+# order: each player's stats and the model's metrics are serialized once, not per request.
 @app.route("/compare_players", methods=["POST"])
 def logistic_regression_endpoint():
     data = request.get_json()
     required = ["player1", "player2"]
     if not data or not all(field in data for field in required):
         return jsonify({"error": f"Missing required fields: {required}"}), 400
+    pending = warming_up("logistic_model")
+    if pending:
+        return pending
     try:
         player1 = data["player1"]
         player2 = data["player2"]
 
-        model, scaler, feature_list, metrics = cache.get("logistic_model")
-        if not model or not scaler or not feature_list:
-            return jsonify({"error": "Logistic model not found in cache."}), 500
-
-        prediction_details = predict_logistic(model, scaler, feature_list, df_games, player1, player2)
+        bundle = logistic_model
+        player1_stats, _, player1_json = comparison_player(player1)
+        player2_stats, _, player2_json = comparison_player(player2)
+        prediction_details = predict_logistic(bundle["predictor"], player1, player2, player1_stats, player2_stats)
         if "error" in prediction_details:
             return jsonify({"error": prediction_details["error"]}), 404
 
-        comparison_result = {
-            "color_specific": prediction_details.get("color_specific"),
-            "color_agnostic": prediction_details.get("color_agnostic"),
-            "top_opening_predictions": prediction_details.get("top_opening_predictions"),
-            "player1": prediction_details.get("player1_stats"),
-            "player2": prediction_details.get("player2_stats"),
-            "comparison_basis": "Logistic regression prediction",
-            "model_accuracy": metrics["test_accuracy"],
-            "cross_validation_score": metrics["cv_accuracy"],
-            "full_feature_importances": metrics["feature_importance"]
-        }
-
-        return jsonify(comparison_result)
+        body = (
+            f'{{"color_agnostic":{compact_json(prediction_details.get("color_agnostic"))},'
+            f'"color_specific":{compact_json(prediction_details.get("color_specific"))},'
+            f'{bundle["model_json"]},"player1":{player1_json},"player2":{player2_json},'
+            f'"top_opening_predictions":{compact_json(prediction_details.get("top_opening_predictions"))}}}\n'
+        )
+        return app.response_class(body, mimetype="application/json")
     except Exception as e:
         logger.exception("Error in /compare_players endpoint")
         return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
 
+# Largest number of players one /compare_players/matrix request may ask for.
+MATRIX_LIMIT = 500
+
+@app.route("/compare_players/matrix", methods=["POST"])
+def compare_players_matrix():
+    data = request.get_json(silent=True)
+    players = data.get("players") if isinstance(data, dict) else None
+    if not isinstance(players, list) or not all(isinstance(p, str) for p in players):
+        return jsonify({"error": "players must be a list of usernames"}), 400
+    players = list(dict.fromkeys(players))
+    if not 2 <= len(players) <= MATRIX_LIMIT:
+        return jsonify({"error": f"Give between 2 and {MATRIX_LIMIT} distinct players"}), 400
+    pending = warming_up("logistic_model")
+    if pending:
+        return pending
+    try:
+        stats = players_stats(players)
+        found = [player for player in players if player in stats]
+        start = time.perf_counter()
+        probabilities = logistic_model["predictor"].win_probabilities(found, stats)
+        logger.info("Win probability matrix for %d players took %.3fs", len(found), time.perf_counter() - start)
+        # JSON has no NaN: a player's entry against themselves is null.
+        rows = [[None if i == j else p for j, p in enumerate(row)] for i, row in enumerate(probabilities.tolist())]
+        header = {"players": found, "not_found": [player for player in players if player not in stats]}
+        if not data.get("stream"):
+            return jsonify(dict(header, probabilities=rows))
+
+        def generate():
+            # Newline-delimited JSON: the header, then one line per row of the matrix.
+            yield app.json.dumps(header) + "\n"
+            for player, row in zip(found, rows):
+                yield app.json.dumps({"player": player, "probabilities": row}) + "\n"
+        return app.response_class(generate(), mimetype="application/x-ndjson")
+    except Exception as e:
+        logger.exception("Error in /compare_players/matrix endpoint")
+        return jsonify({"error": str(e)}), 500
+
+warmup.start()
+if REFRESH_SECONDS:
+    threading.Thread(target=watch_dataset, name="refresh", daemon=True).start()
+
 if __name__ == "__main__":
     logger.info("Starting development server with detailed logs on port 5000...")
     app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
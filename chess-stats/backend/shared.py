@@ -0,0 +1,62 @@
+import os
+import fcntl
+import logging
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+INDEX_COLUMN = "__index__"
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on path across processes for the duration of the block."""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_shared_table(df, path):
+    """Writes a DataFrame as an uncompressed Arrow IPC file that processes can memory-map."""
+    table = pa.Table.from_pandas(df.assign(**{INDEX_COLUMN: df.index}), preserve_index=False).combine_chunks()
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    logger.info("Wrote shared table %s (%d rows)", path, len(df))
+
+
+def _column(array, categories):
+    # Wraps an Arrow array as a pandas column that reads from the same buffers.
+    if array.null_count:
+        return array.to_pandas()
+    if pa.types.is_dictionary(array.type):
+        dictionary = array.dictionary.to_pandas()
+        # Columns with equal dictionaries (White and Black) share one dtype.
+        dtype = next((d for d in categories if d.categories.equals(pd.Index(dictionary))), None)
+        if dtype is None:
+            dtype = pd.CategoricalDtype(dictionary)
+            categories.append(dtype)
+        return pd.Categorical.from_codes(array.indices.to_numpy(zero_copy_only=True), dtype=dtype)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return pd.arrays.ArrowStringArray(pa.chunked_array([array]))
+    return array.to_numpy(zero_copy_only=True)
+
+
+def open_shared_table(path):
+    """Memory-maps a table written by write_shared_table.
+
+    Column data stays in the mapped file, so every process that opens the same
+    file shares one copy through the page cache. The arrays are read-only.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    categories = []
+    columns = {name: _column(column.chunk(0) if column.num_chunks == 1 else column.combine_chunks(), categories)
+               for name, column in zip(table.column_names, table.columns)}
+    index = pd.Index(columns.pop(INDEX_COLUMN), copy=False)
+    return pd.DataFrame(columns, index=index, copy=False)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from load_data import build_game_record, compact_games
+from kmeans_alg import aggregate_player_features, update_player_features
+
+
+def growing_games(num_games=600, seed=0):
+    """Games whose later rows bring new players, openings and variants, with many tied counts."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(num_games):
+        # The pools widen as the file grows, so appended games meet new names.
+        players = 4 + i // 40
+        white, black = (f"p{n}" for n in rng.choice(players, 2, replace=False))
+        headers = {
+            "Event": "Rated Blitz game", "White": white, "Black": black, "Result": "1-0",
+            "WhiteElo": str(rng.integers(1000, 2000)), "BlackElo": str(rng.integers(1000, 2000)),
+            "Opening": f"Opening {rng.integers(3 + i // 60)}: Line {rng.integers(2)}",
+            "TimeControl": ["60+0", "180+2", "600+0", "1800+0"][rng.integers(1 + i // 200)]
+        }
+        records.append(build_game_record(headers, int(rng.integers(10, 80))))
+    return compact_games(pd.DataFrame(records))
+
+
+def assert_same_features(actual, expected):
+    pd.testing.assert_frame_equal(actual[0], expected[0], check_exact=True)
+    for actual_counts, expected_counts in zip(actual[1:], expected[1:]):
+        assert actual_counts.vocabulary == expected_counts.vocabulary
+        assert actual_counts.matrix.shape == expected_counts.matrix.shape
+        assert (actual_counts.matrix != expected_counts.matrix).nnz == 0
+    assert (actual[1].first_seen != expected[1].first_seen).nnz == 0
+
+
+@pytest.mark.parametrize("cuts", [[599], [300], [1, 2, 450], [100, 100, 250, 500]])
+def test_update_player_features_matches_full_aggregation(cuts):
+    df = growing_games()
+    features = aggregate_player_features(df.iloc[:cuts[0]])
+    for start, end in zip(cuts, cuts[1:] + [len(df)]):
+        features = update_player_features(*features, df.iloc[start:end])
+    assert_same_features(features, aggregate_player_features(df))
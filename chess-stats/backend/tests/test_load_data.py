@@ -0,0 +1,139 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import load_data
+
+UNRATED_GAME = """[Event "Casual"]
+[White "a"]
+[Black "b"]
+[Result "1-0"]
+
+1. e4 e5 1-0
+
+"""
+
+RATED_GAME = """[Event "Rated Blitz game"]
+[White "a"]
+[Black "c"]
+[WhiteElo "1500"]
+[BlackElo "1600"]
+[Result "0-1"]
+
+1. d4 d5 0-1
+
+"""
+
+
+@pytest.fixture(autouse=True)
+def no_dataset():
+    yield
+    load_data.dataset = None
+
+
+def assert_compact(games):
+    for col in load_data.PLAYER_COLUMNS + load_data.CATEGORY_COLUMNS + load_data.OPENING_COLUMNS:
+        assert isinstance(games[col].dtype, pd.CategoricalDtype), col
+    assert str(games[load_data.TIME_COLUMN].dtype) == "datetime64[ns]"
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_all_unrated_pgn_loads_empty(tmp_path, cached):
+    pgn = tmp_path / "unrated.pgn"
+    pgn.write_text(UNRATED_GAME * 3)
+    cache_dir = str(tmp_path / "cache") if cached else None
+
+    games = load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+    assert len(games) == 0
+    assert_compact(games)
+    assert load_data.dataset.player_counts.empty
+    if cached:
+        # Read back from the cache by a fresh process.
+        load_data.dataset = None
+        games = load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+        assert len(games) == 0
+        assert_compact(games)
+
+
+def test_rated_games_appended_to_an_empty_cache(tmp_path):
+    pgn = tmp_path / "unrated.pgn"
+    pgn.write_text(UNRATED_GAME)
+    cache_dir = str(tmp_path / "cache")
+    load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+    with open(pgn, "a") as f:
+        f.write(RATED_GAME)
+
+    games = load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+    assert list(games["Black"]) == ["c"]
+    assert load_data.dataset.player_counts.to_dict() == {"a": 1, "c": 1}
+    load_data.dataset = None
+    games = load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+    assert_compact(games)
+    assert list(games["Black"]) == ["c"]
+
+
+def timed_game(white, black, date, time, opening):
+    return f"""[Event "Rated Blitz game"]
+[White "{white}"]
+[Black "{black}"]
+[WhiteElo "1500"]
+[BlackElo "1600"]
+[Result "1-0"]
+[UTCDate "{date}"]
+[UTCTime "{time}"]
+[ECO "{opening[0]}"]
+[Opening "{opening[1]}"]
+[TimeControl "180+0"]
+
+1. e4 e5 1-0
+
+"""
+
+
+def random_games(rng, count, players):
+    openings = [("B20", "Sicilian Defense"), ("B90", "Sicilian Defense: Najdorf Variation"),
+                ("C20", "King's Pawn Game"), ("A00", "Sicilian Defense"), ("D00", "Queen's Pawn Game")]
+    games = []
+    for _ in range(count):
+        white, black = rng.choice(players, 2)
+        if rng.random() < 0.05:
+            black = white
+        # Few distinct times, so that ties and games out of file order are common.
+        date = "????.??.??" if rng.random() < 0.03 else f"2024.01.{rng.integers(1, 4):02d}"
+        games.append(timed_game(white, black, date, f"12:00:{rng.integers(0, 3):02d}",
+                                openings[rng.integers(len(openings))]))
+    return "".join(games)
+
+
+def assert_same_indexes(extended, built):
+    def same(a, b):
+        if isinstance(a, pd.Index):
+            return a.equals(b)
+        # NaT never equals itself; games without a time sort last in both.
+        return np.array_equal(a, b, equal_nan=np.asarray(a).dtype.kind == "M")
+    for name in ("players", "rows", "is_white", "times", "offsets", "chronological", "num_rows"):
+        assert same(getattr(extended.player_index, name), getattr(built.player_index, name)), name
+    for name in ("order", "times", "chronological"):
+        assert same(getattr(extended.time_index, name), getattr(built.time_index, name)), name
+    assert extended.opening_hierarchy.opening_families == built.opening_hierarchy.opening_families
+    assert same(extended.opening_hierarchy.variation_parent, built.opening_hierarchy.variation_parent)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_appended_games_extend_the_indexes(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    pgn = tmp_path / "growing.pgn"
+    pgn.write_text(random_games(rng, 200, [f"p{i}" for i in range(20)]))
+    cache_dir = str(tmp_path / "cache")
+    load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+    for step in range(3):
+        with open(pgn, "a") as f:
+            # New players join as the file grows.
+            f.write(random_games(rng, 50, [f"p{i}" for i in range(20 + 5 * step)]))
+        games = load_data.load_dataset(str(pgn), header_only=True, cache_dir=cache_dir)
+        extended = load_data.dataset
+        assert_same_indexes(extended, load_data._publish_dataset(games, extended.player_counts, extended.meta))
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+from load_data import build_game_record, compact_games, load_dataset
+from personalized_stats_alg import get_detailed_stats, get_all_detailed_stats
+
+EXAMPLE_PGN = os.path.join(BACKEND_DIR, "..", "datasets", "example.pgn")
+
+RESULTS = ["1-0", "0-1", "1/2-1/2"]
+
+
+def synthetic_games(seed=0):
+    """Random games over few players and openings, so counts tie often.
+
+    "wide" plays 40 openings and 40 opponents once each: more tied keys than
+    numpy's quicksort handles by insertion sort, so the tie order depends on
+    the exact sort value_counts uses. "self" also plays against themselves.
+    """
+    rng = np.random.default_rng(seed)
+    players = [f"p{i}" for i in range(12)] + ["self"]
+    openings = [f"Opening {i}: Line {j}" for i in range(6) for j in range(3)]
+    time_controls = ["60+0", "180+2", "600+0", "1800+0"]
+    records = []
+
+    def add(white, black, opening=None):
+        headers = {
+            "Event": "Rated Blitz game", "White": white, "Black": black,
+            "Result": RESULTS[rng.integers(3)], "UTCDate": "2024.01.01", "UTCTime": "12:00:00",
+            "WhiteElo": str(rng.integers(1000, 2000)), "BlackElo": str(rng.integers(1000, 2000)),
+            "ECO": "B20", "Opening": opening or openings[rng.integers(len(openings))],
+            "TimeControl": time_controls[rng.integers(len(time_controls))]
+        }
+        records.append(build_game_record(headers, int(rng.integers(10, 80))))
+
+    for _ in range(400):
+        white, black = rng.choice(players, 2, replace=False)
+        add(white, black)
+    for _ in range(6):
+        add("self", "self")
+    for i in range(40):
+        white, black = ("wide", f"w{i}") if i % 2 else (f"w{i}", "wide")
+        add(white, black, f"Wide {i}")
+    return compact_games(pd.DataFrame(records))
+
+
+def ordered(value):
+    """Makes dict key order part of equality."""
+    if isinstance(value, dict):
+        return [(key, ordered(item)) for key, item in value.items()]
+    if isinstance(value, list):
+        return [ordered(item) for item in value]
+    return value
+
+
+@pytest.mark.parametrize("name, load", [
+    ("synthetic", synthetic_games),
+    ("example.pgn", lambda: load_dataset(EXAMPLE_PGN, header_only=True, cache_dir=None)),
+])
+def test_batched_stats_match_per_player_stats(name, load):
+    df = load()
+    usernames = df["White"].cat.categories.tolist() + ["nobody"]
+    batched = get_all_detailed_stats(df, usernames)
+    assert list(batched) == usernames
+    for username in usernames:
+        assert ordered(batched[username]) == ordered(get_detailed_stats(df, username)), username
@@ -0,0 +1,75 @@
+import io
+import os
+import sys
+
+import chess.pgn
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+from pgn_reader import read_game_header_only, open_pgn
+
+EXAMPLE_PGN = os.path.join(BACKEND_DIR, "..", "datasets", "example.pgn")
+
+# Comments, NAGs, nested variations, "%" and ";" escapes, a null move, a
+# missing Result tag (taken from the movetext) and a game with no result at all.
+TRICKY_PGN = """﻿% escape line
+[Event "Casual"]
+[White "a"]
+[Black "b"]
+[WhiteElo "1500"]
+[BlackElo "1600"]
+
+; line comment
+1. e4 { multi
+line comment } e5 2. Nf3 ( 2. f4 ( 2. d4 exd4 ) exf4 3. Bc4 ) ( 2. Bc4 ) Nc6 $1 3. Bb5!? -- 4. O-O ; trailing
+4... a6 1/2-1/2
+
+[Event "Rated Blitz game"]
+
+[White "c"]
+[Black "d"]
+[Opening "Sicilian \\"x\\""]
+1. ( e4 ) e5 ( d5 ( c5 ) ) 2. Nf3 { c } ( 2. Nc3 ) $2 Nf6 1-0
+
+% between games
+[Event "No result"]
+[White "e"]
+[Black "f"]
+
+1. d4 d5 2. c4 { (not a variation) } e6 ( 2... c6 3. Nf3 ( 3. Nc3 dxc4 ) ) 3. Nc3 $14
+
+[WhiteElo "1700"]
+[BlackElo "1800"]
+1. e4 e5 *
+"""
+
+
+def read_all(handle, reader):
+    games = []
+    while True:
+        game = reader(handle)
+        if game is None:
+            return games
+        games.append(game)
+
+
+def chess_pgn_reader(handle):
+    game = chess.pgn.read_game(handle)
+    if game is None:
+        return None
+    return dict(game.headers), len(list(game.mainline_moves()))
+
+
+@pytest.mark.parametrize("name, open_text", [
+    ("example.pgn", lambda: open_pgn(EXAMPLE_PGN)),
+    ("tricky", lambda: io.StringIO(TRICKY_PGN)),
+])
+def test_header_only_matches_chess_pgn(name, open_text):
+    with open_text() as handle:
+        expected = read_all(handle, chess_pgn_reader)
+    with open_text() as handle:
+        actual = read_all(handle, read_game_header_only)
+    assert len(expected) > 0
+    assert [dict(headers) for headers, _ in actual] == [headers for headers, _ in expected]
+    assert [plies for _, plies in actual] == [plies for _, plies in expected]
@@ -0,0 +1,79 @@
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TIME_COLUMN = "UTCDateTime"
+NOT_A_TIME = np.datetime64("NaT", "ns")
+
+
+def parse_window(args):
+    """Reads since and until (ISO dates or times, UTC) from a query string or JSON body.
+
+    Returns (since, until) as datetime64 values, None where not given. since
+    is inclusive and until exclusive. Raises ValueError on bad input.
+    """
+    window = []
+    for name in ("since", "until"):
+        value = args.get(name)
+        if value is None or value == "":
+            window.append(None)
+            continue
+        try:
+            timestamp = pd.Timestamp(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {name}: expected an ISO date or time, e.g. 2024-01-31 or 2024-01-31T18:00")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+        window.append(timestamp.to_datetime64().astype("datetime64[ns]"))
+    since, until = window
+    if since is not None and until is not None and since >= until:
+        raise ValueError("since must be before until.")
+    return since, until
+
+
+def window_bounds(times, since=None, until=None):
+    """Binary-searches sorted times (NaT last) for the positions [start, end) inside the window.
+
+    Games with no time are never inside a window, even an open-ended one.
+    """
+    start = 0 if since is None else int(np.searchsorted(times, since, side="left"))
+    end = int(np.searchsorted(times, NOT_A_TIME if until is None else until, side="left"))
+    return start, max(start, end)
+
+
+class TimeIndex:
+    """The df_games row positions sorted by UTCDateTime, for since/until slices.
+
+    order lists row positions by time (ties and games without a time keep
+    file order, the latter last), and times is the matching sorted column.
+    """
+
+    def __init__(self, df, previous=None):
+        """Sorts the times of df, or with previous (the index of its leading
+        rows) just the times of the rows after those, merging them in."""
+        times = df[TIME_COLUMN].to_numpy()
+        if previous is None:
+            self.order = np.argsort(times, kind="stable")
+            self.times = times[self.order]
+            # Most PGN exports are written in time order; then a window is a plain slice of the rows.
+            self.chronological = bool(np.all(self.order[1:] > self.order[:-1]))
+        else:
+            start = len(previous.order)
+            order = np.argsort(times[start:], kind="stable")
+            added = times[start:][order]
+            # Ties go after the earlier rows, as in a stable sort of all of them.
+            at = np.searchsorted(previous.times, added, side="right")
+            self.order = np.insert(previous.order, at, order + start)
+            self.times = np.insert(previous.times, at, added)
+            self.chronological = (previous.chronological and bool(np.all(at == start))
+                                  and bool(np.all(order[1:] > order[:-1])))
+        logger.info("Built time index over %d games (%s)", len(df),
+                    "chronological" if self.chronological else "sorted")
+
+    def rows_between(self, since=None, until=None):
+        """Returns the row positions, in file order, of the games inside the window."""
+        start, end = window_bounds(self.times, since, until)
+        rows = self.order[start:end]
+        return rows if self.chronological else np.sort(rows)
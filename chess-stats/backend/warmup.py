@@ -0,0 +1,68 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs named startup stages one after another on a background thread.
+
+    Stages run in the order they were added. If a required stage fails, the
+    stages after it are marked failed too instead of running on missing data.
+    """
+
+    def __init__(self):
+        self._stages = OrderedDict()
+        self._funcs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, name, func, required=False):
+        self._stages[name] = {"name": name, "status": "pending", "seconds": None, "error": None}
+        self._funcs[name] = (func, required)
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._stages[name].update(fields)
+
+    def _run(self):
+        blocked_by = None
+        for name, (func, required) in self._funcs.items():
+            if blocked_by is not None:
+                self._update(name, status="failed", error=f"{blocked_by} failed")
+                continue
+            logger.info("Warm-up stage %s starting", name)
+            self._update(name, status="running")
+            start = time.perf_counter()
+            try:
+                func()
+                self._update(name, status="done", seconds=round(time.perf_counter() - start, 3))
+                logger.info("Warm-up stage %s done in %.2fs", name, time.perf_counter() - start)
+            except Exception as e:
+                logger.exception("Warm-up stage %s failed", name)
+                self._update(name, status="failed", error=str(e), seconds=round(time.perf_counter() - start, 3))
+                if required:
+                    blocked_by = name
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Blocks until every stage has finished or failed."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self, name):
+        with self._lock:
+            return dict(self._stages[name])
+
+    def stages(self):
+        with self._lock:
+            return [dict(stage) for stage in self._stages.values()]
+
+    def ready(self):
+        with self._lock:
+            return all(stage["status"] == "done" for stage in self._stages.values())
@@ -1,12 +1,17 @@
+import os
+import sys
 import chess.pgn
 import pandas as pd
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "chess-stats", "backend"))
+from pgn_reader import open_pgn
+
 def parse_pgn(file_path, max_games=1000000):
     opening_stats = defaultdict(lambda: {'wins': 0, 'losses': 0, 'draws': 0, 'total': 0})
     game_lengths = []
     
-    with open(file_path) as pgn:
+    with open_pgn(file_path) as pgn:
         for _ in range(max_games):
             game = chess.pgn.read_game(pgn)
             if game is None:
@@ -1,12 +1,17 @@
 import pandas as pd
 from typing import List, Dict
-import re
+import os
+import sys
 
 import chess.pgn
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chess-stats", "backend"))
+from pgn_reader import open_pgn
+from openings import main_opening
+
 def parse_pgn(file_path: str) -> List[chess.pgn.Game]:
     games = []
-    with open(file_path) as pgn:
+    with open_pgn(file_path) as pgn:
         while True:
             game = chess.pgn.read_game(pgn)
             if game is None:
@@ -23,7 +28,7 @@ def extract_features(games: List[chess.pgn.Game]) -> pd.DataFrame:
         
         white_elo = int(game.headers["WhiteElo"]) if game.headers["WhiteElo"].isdigit() else 0
         black_elo = int(game.headers["BlackElo"]) if game.headers["BlackElo"].isdigit() else 0
-        opening = re.split(r'[:#,]', game.headers["Opening"])[0].strip()
+        opening = main_opening(game.headers["Opening"])
         
         data.append({
             "white_elo": white_elo,
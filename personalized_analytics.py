@@ -4,8 +4,12 @@ import chess.pgn
 import pandas as pd
 import collections
 import os
-import re
 import numpy as np  
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "chess-stats", "backend"))
+from pgn_reader import open_pgn
+from openings import main_opening
 
 app = Flask(__name__)
 CORS(app)
@@ -30,7 +34,7 @@ def load_pgn_to_dataframe(pgn_file_path):
         print(f"PGN file not found at: {pgn_file_path}")
         return pd.DataFrame()
 
-    with open(pgn_file_path, "r", encoding="utf-8") as pgn_file:
+    with open_pgn(pgn_file_path) as pgn_file:
         while True:
             game = chess.pgn.read_game(pgn_file)
             if game is None:
@@ -54,6 +58,9 @@ def load_pgn_to_dataframe(pgn_file_path):
                 print(f"Processed {game_count} games...")
 
     df_games = pd.DataFrame(games_list)
+    # Parsed once per distinct opening name (main_opening is memoized), not per request.
+    if not df_games.empty:
+        df_games["MainOpening"] = df_games["Opening"].map(main_opening)
     print(f"Processing finished! Loaded {len(df_games)} games into DataFrame.")
 
 def get_user_stats(username):
@@ -78,8 +85,6 @@ def get_user_stats(username):
     total_games = len(user_games)
     avg_rating = user_games[["WhiteElo", "BlackElo"]].mean().mean()
 
-    user_games["MainOpening"] = user_games["Opening"].apply(lambda x: re.split(r'[:#,]', x)[0].strip())
-
     openings_count = user_games["MainOpening"].value_counts().reset_index()
     openings_count.columns = ["name", "count"] 
     openings_data = openings_count.to_dict(orient="records")
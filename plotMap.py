@@ -8,11 +8,15 @@ import numpy as np
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from shapely.geometry import LineString, Point
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "chess-stats", "backend"))
+from pgn_reader import open_pgn
 
 def parse_pgn(file_path):
     games = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as pgn:
+        with open_pgn(file_path) as pgn:
             while game := chess.pgn.read_game(pgn):
                 games.append({
                     "White": game.headers.get("White", "Unknown"),
@@ -1,27 +1,33 @@
-import chess.pgn
+import os
+import sys
 import collections
 
-def find_most_active_player(pgn_file_path):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "chess-stats", "backend"))
+from pgn_reader import iter_games, map_shards
+
+def count_players(pgn_file):
     player_counts = collections.Counter()
     game_count = 0
     checkpoint = 5000 
 
-    with open(pgn_file_path, "r", encoding="utf-8") as pgn_file:
-        while True:
-            game = chess.pgn.read_game(pgn_file)
-            if game is None:
-                break  
+    for headers, _ in iter_games(pgn_file, header_only=True):
+        white_player = headers.get("White", "Unknown")
+        black_player = headers.get("Black", "Unknown")
+
+        player_counts[white_player] += 1
+        player_counts[black_player] += 1
 
-            white_player = game.headers.get("White", "Unknown")
-            black_player = game.headers.get("Black", "Unknown")
+        game_count += 1
 
-            player_counts[white_player] += 1
-            player_counts[black_player] += 1
+        if game_count % checkpoint == 0:
+            print(f"Processed {game_count} games...")
 
-            game_count += 1
+    return player_counts
 
-            if game_count % checkpoint == 0:
-                print(f"Processed {game_count} games...")
+def find_most_active_player(pgn_file_path, workers=None):
+    player_counts = collections.Counter()
+    for shard_counts in map_shards(pgn_file_path, count_players, workers):
+        player_counts.update(shard_counts)
 
     most_active_player, most_games = player_counts.most_common(1)[0]
 